@@ -0,0 +1,100 @@
+"""Buffered, batched writer for the append-only audit log.
+
+Request handlers hand audit entries to an in-process queue and return without
+a database round trip. A background task drains the queue and inserts entries
+in batches, flushing when ``batch_size`` entries are pending or ``flush_interval``
+seconds have passed. When the queue is full, ``record`` waits for room, so a
+stalled database slows producers down instead of growing memory without bound.
+"""
+import asyncio
+import datetime
+import json
+import os
+from sqlalchemy import insert
+import models
+
+
+class AuditWriter:
+    def __init__(self, session_factory, batch_size=None, flush_interval=None, max_pending=None):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+        self.max_pending = max_pending or int(os.getenv("AUDIT_MAX_PENDING", "10000"))
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def record(self, username, action, vm_name=None, resource_group=None, outcome="ok", detail=None):
+        entry = {
+            "created_at": datetime.datetime.utcnow(),
+            "username": username,
+            "action": action,
+            "vm_name": vm_name,
+            "resource_group": resource_group,
+            "outcome": outcome,
+            "detail": json.dumps(detail) if detail is not None else None,
+        }
+        if not self.running:
+            # Not started (e.g. scripts importing main): write through
+            await self._write([entry])
+            return
+        await self._queue.put(entry)
+
+    async def flush(self):
+        """Wait until every entry queued so far has been written."""
+        if self.running:
+            await self._queue.join()
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        stopping = False
+        while not stopping:
+            batch = []
+            item = await self._queue.get()
+            deadline = loop.time() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+            if batch:
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    print(f"audit: failed to write {len(batch)} entries: {e}")
+            for _ in range(len(batch) + (1 if stopping else 0)):
+                self._queue.task_done()
+
+    async def _write(self, entries):
+        async with self.session_factory() as db:
+            await db.execute(insert(models.AuditLog.__table__), entries)
+            await db.commit()
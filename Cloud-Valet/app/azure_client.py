@@ -0,0 +1,84 @@
+"""Asyncio Azure clients sharing one long-lived, pooled HTTP session.
+
+The aiohttp session is opened at startup and closed at shutdown. Every
+credential and ``ComputeManagementClient`` is built on a transport that
+borrows it (``session_owner=False``), so token requests and ARM calls reuse
+the same keep-alive connections, and an in-flight VM operation is a coroutine
+rather than a thread. Clients (compute, and resources for listing resource
+groups) are cached per set of provider credentials and rebuilt when the
+credentials change.
+"""
+import hashlib
+import os
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import ClientSecretCredential
+from azure.mgmt.compute.aio import ComputeManagementClient
+from azure.mgmt.resource.resources.aio import ResourceManagementClient
+
+MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+
+
+class AzureClients:
+    def __init__(self, max_connections=None, keepalive_timeout=None):
+        self.max_connections = max_connections or int(os.getenv("AZURE_MAX_CONNECTIONS", "100"))
+        self.keepalive_timeout = keepalive_timeout or float(os.getenv("AZURE_KEEPALIVE_TIMEOUT", "60"))
+        self._session = None
+        self._key = None
+        self._credential = None
+        self._compute = None
+        self._resources = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        clients = (self._compute, self._resources, self._credential)
+        self._key = self._compute = self._resources = self._credential = None
+        await self._close_clients(*clients)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _transport(self):
+        return AioHttpTransport(session=self._session, session_owner=False)
+
+    async def _use(self, tenant_id, client_id, client_secret, subscription_id):
+        if self._session is None:
+            await self.start()
+        key = hashlib.sha256("\0".join([tenant_id, client_id, client_secret, subscription_id]).encode()).hexdigest()
+        clients = (self._compute, self._resources, self._credential)
+        if key != self._key:
+            old_clients = (self._compute, self._resources, self._credential)
+            self._credential = ClientSecretCredential(tenant_id, client_id, client_secret, transport=self._transport())
+            self._compute = ComputeManagementClient(self._credential, subscription_id, transport=self._transport())
+            self._resources = ResourceManagementClient(self._credential, subscription_id, transport=self._transport())
+            clients = (self._compute, self._resources, self._credential)
+            self._key = key
+            await self._close_clients(*old_clients)
+        return clients
+
+    async def compute(self, tenant_id, client_id, client_secret, subscription_id):
+        """The compute client for these credentials, created on first use."""
+        return (await self._use(tenant_id, client_id, client_secret, subscription_id))[0]
+
+    async def resources(self, tenant_id, client_id, client_secret, subscription_id):
+        """The resource management client for these credentials, created on first use."""
+        return (await self._use(tenant_id, client_id, client_secret, subscription_id))[1]
+
+    async def token(self, tenant_id, client_id, client_secret, subscription_id):
+        """Fetch an ARM access token; the credential caches it for the clients' later calls."""
+        credential = (await self._use(tenant_id, client_id, client_secret, subscription_id))[2]
+        return await credential.get_token(MANAGEMENT_SCOPE)
+
+    @staticmethod
+    async def _close_clients(*clients):
+        # Closing only releases the clients' pipelines; the shared session stays open
+        for client in clients:
+            if client is not None:
+                try:
+                    await client.close()
+                except Exception:
+                    pass
@@ -0,0 +1,220 @@
+"""Cache shared by every uvicorn worker, for VM inventory and auth lookups.
+
+Backends share one small async interface: ``get``, ``set`` (with a TTL in
+seconds), ``replace`` (update a live entry, keeping its expiry), ``delete``
+and ``lock``. Values must be JSON-serialisable.
+
+- ``FileCache`` keeps one file per key in a directory shared by the workers on
+  a host. By default it uses ``/dev/shm``, which is a tmpfs backed by shared
+  memory, so reads and writes never touch a disk. Cross-process locks use
+  ``fcntl.flock``. The directory must belong to the current user and be
+  private to it (it is created with mode 0700).
+- ``RedisCache`` wraps any client with the ``redis.asyncio`` API (``get``,
+  ``set(ex=/px=/nx=/xx=/keepttl=)``, ``delete``) for multi-node deployments. ``LocalRedis``
+  is an in-process stand-in with the same API for tests and local runs.
+
+``get_or_refresh`` takes the key's lock before refreshing, so when many
+workers miss at once, one of them refreshes and the others read its result.
+Its ``lock_timeout`` must cover the longest refresh: a Redis lock expires
+after that long, and a worker that waits that long without getting the lock
+never refreshes on its own, it raises ``LockTimeout`` instead.
+"""
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+import uuid
+
+
+class LockTimeout(TimeoutError):
+    pass
+
+
+class FileCache:
+    def __init__(self, directory=None, namespace="cloudvalet"):
+        if directory is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.directory = os.path.join(directory, namespace)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # The path is predictable and entries include auth lookups: refuse a directory another local user
+        # created (or swapped for a symlink) or can write to, since they could plant entries in it
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+            raise RuntimeError(
+                f"cache directory {self.directory} must be a directory owned by this user and not writable by group or others"
+            )
+
+    def _path(self, key, suffix=".json"):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+    def _read(self, key):
+        # The entry ({"expires", "value"}) while it is live, else None
+        try:
+            with open(self._path(key), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires"] is not None and entry["expires"] < time.time():
+            return None
+        return entry
+
+    async def get(self, key):
+        entry = self._read(key)
+        return entry["value"] if entry is not None else None
+
+    async def set(self, key, value, ttl=None):
+        self._write(key, {"expires": time.time() + ttl if ttl else None, "value": value})
+
+    async def replace(self, key, value):
+        """Overwrite ``key`` only while it holds an unexpired value, keeping its expiry; returns whether it did."""
+        entry = self._read(key)
+        if entry is None:
+            return False
+        self._write(key, {"expires": entry["expires"], "value": value})
+        return True
+
+    def _write(self, key, entry):
+        # Write to a temp file and rename over the old one so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    async def delete(self, key):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path(key))
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key, timeout=30.0):
+        """Hold an exclusive cross-process lock on ``key``; gives up waiting after ``timeout`` seconds."""
+        with open(self._path(key, ".lock"), "a") as f:
+            deadline = time.monotonic() + timeout
+            locked = False
+            while not locked:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        break
+                    await asyncio.sleep(0.05)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RedisCache:
+    def __init__(self, client, prefix="cloudvalet:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key):
+        raw = await self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, value, ttl=None):
+        await self.client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def replace(self, key, value):
+        return bool(await self.client.set(self.prefix + key, json.dumps(value), xx=True, keepttl=True))
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key, timeout=30.0):
+        lock_key, token = self.prefix + "lock:" + key, uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        locked = False
+        while not locked:
+            # The lock expires on its own if its holder dies mid-refresh
+            locked = bool(await self.client.set(lock_key, token, px=int(timeout * 1000), nx=True))
+            if not locked:
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(0.05)
+        try:
+            yield locked
+        finally:
+            if locked and await self.client.get(lock_key) in (token, token.encode()):
+                await self.client.delete(lock_key)
+
+
+class LocalRedis:
+    """Minimal in-process stand-in for a ``redis.asyncio.Redis`` client."""
+
+    def __init__(self):
+        self._data = {}
+
+    async def get(self, name):
+        entry = self._data.get(name)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            del self._data[name]
+            return None
+        return value
+
+    async def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        exists = await self.get(name) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        if keepttl and exists:
+            expires = self._data[name][1]
+        else:
+            ttl = ex if ex is not None else (px / 1000 if px is not None else None)
+            expires = time.monotonic() + ttl if ttl is not None else None
+        self._data[name] = (value, expires)
+        return True
+
+    async def delete(self, *names):
+        return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+
+def cache_from_env():
+    backend = os.getenv("CACHE_BACKEND", "file")
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        return RedisCache(redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+    if backend == "local":
+        return RedisCache(LocalRedis())
+    return FileCache(os.getenv("CACHE_DIR"))
+
+
+async def get_or_refresh(cache, key, ttl, refresh, force=False, lock_timeout=30.0):
+    """Return the cached value for ``key``, or compute it with ``refresh()`` under the key's lock."""
+    if not force:
+        value = await cache.get(key)
+        if value is not None:
+            return value
+    async with cache.lock(key, timeout=lock_timeout) as locked:
+        if not locked:
+            # Whoever holds the lock is still refreshing; use its result if it has landed, never refresh alongside it
+            value = await cache.get(key)
+            if value is not None:
+                return value
+            raise LockTimeout(f"timed out after {lock_timeout:g}s waiting for {key} to be refreshed")
+        if not force:
+            # Another worker may have refreshed while we waited for the lock
+            value = await cache.get(key)
+            if value is not None:
+                return value
+        value = await refresh()
+        await cache.set(key, value, ttl)
+        return value
@@ -0,0 +1,43 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine
+from db import Base, engine_options
+
+@pytest_asyncio.fixture
+async def sqlite_db(tmp_path):
+    """Factory for throwaway SQLite databases with the app's tables: ``await sqlite_db(name, {Model: [rows]})``."""
+    engines = []
+    async def make(name="test", rows=None):
+        url = f"sqlite+aiosqlite:///{tmp_path / name}.db"
+        engine = create_async_engine(url, **engine_options(url))
+        engines.append(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            for model, values in (rows or {}).items():
+                await conn.execute(model.__table__.insert(), values)
+        return engine
+    yield make
+    for engine in engines:
+        await engine.dispose()
+
+@pytest_asyncio.fixture
+async def main_db(sqlite_db, monkeypatch):
+    """Point main's sessions at a throwaway SQLite database: ``SessionLocal = await main_db({Model: [rows]})``."""
+    import main
+    from db import session_factories
+    async def make(rows=None):
+        SessionLocal, ReadSessionLocal = session_factories(await sqlite_db("main", rows))
+        monkeypatch.setattr(main, "SessionLocal", SessionLocal)
+        monkeypatch.setattr(main, "ReadSessionLocal", ReadSessionLocal)
+        return SessionLocal
+    return make
+
+@pytest.fixture
+def audited(monkeypatch):
+    """Capture main's audit entries as (args, kwargs) instead of writing them to the database."""
+    import main
+    entries = []
+    async def record(*args, **kwargs):
+        entries.append((args, kwargs))
+    monkeypatch.setattr(main.audit_log, "record", record)
+    return entries
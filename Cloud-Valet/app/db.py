@@ -1,12 +1,99 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+import asyncio
 import os
 import dotenv
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://cloudvalet:cloudvaletpass@db:5432/cloudvaletdb")
+# Optional read replica for read-only handlers
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Seconds a replica may trail the primary; data changed more recently is read from the primary
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
-SessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+def _setting(prefix, name, default):
+    # DB_REPLICA_* settings fall back to the DB_* ones
+    value = os.getenv(prefix + name) or os.getenv("DB_" + name)
+    return value if value else default
+
+def engine_options(url, prefix="DB_"):
+    """Pool and statement-cache keyword arguments for create_async_engine(), from DB_* (or DB_REPLICA_*) variables."""
+    options = {
+        "echo": _setting(prefix, "ECHO", "0") == "1",
+        "pool_pre_ping": _setting(prefix, "POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(_setting(prefix, "POOL_RECYCLE", "1800")),
+        # SQLAlchemy's cache of compiled statements
+        "query_cache_size": int(_setting(prefix, "QUERY_CACHE_SIZE", "500")),
+    }
+    if ":memory:" not in url:
+        options["pool_size"] = int(_setting(prefix, "POOL_SIZE", "5"))
+        options["max_overflow"] = int(_setting(prefix, "MAX_OVERFLOW", "10"))
+        options["pool_timeout"] = float(_setting(prefix, "POOL_TIMEOUT", "30"))
+    if "+asyncpg" in url:
+        # Prepared statements asyncpg keeps per connection
+        options["connect_args"] = {"prepared_statement_cache_size": int(_setting(prefix, "STATEMENT_CACHE_SIZE", "100"))}
+    return options
+
+engine = create_async_engine(DATABASE_URL, future=True, **engine_options(DATABASE_URL))
+replica_engine = (
+    create_async_engine(DATABASE_REPLICA_URL, future=True, **engine_options(DATABASE_REPLICA_URL, "DB_REPLICA_"))
+    if DATABASE_REPLICA_URL else None
+)
+
+class RoutingSession(Session):
+    """Sends read-only sessions to the replica until they write; everything else goes to the primary."""
+    primary = None
+    replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica is None or not self.info.get("read_only"):
+            return self.primary
+        if self._flushing or getattr(clause, "is_dml", False) or getattr(clause, "_for_update_arg", None) is not None:
+            # Read your writes: once the session writes it stays on the primary
+            self.info["pinned"] = True
+        return self.primary if self.info.get("pinned") else self.replica
+
+def session_factories(primary, replica=None):
+    """(read-write, read-only) AsyncSession factories over the given engines."""
+    routing = type("RoutingSession", (RoutingSession,), {
+        "primary": primary.sync_engine,
+        "replica": replica.sync_engine if replica is not None else None,
+    })
+    return (
+        sessionmaker(class_=AsyncSession, sync_session_class=routing, expire_on_commit=False),
+        sessionmaker(class_=AsyncSession, sync_session_class=routing, expire_on_commit=False, info={"read_only": True}),
+    )
+
+def use_primary(session):
+    """Route the rest of this session to the primary, e.g. to read something that was just written."""
+    session.info["pinned"] = True
+
+async def warm_pool(engine, connections=None):
+    """Open ``connections`` (default: the pool size) connections at once and return them to the pool idle."""
+    if connections is None:
+        size = getattr(engine.sync_engine.pool, "size", None)
+        connections = size() if size else 1
+    results = await asyncio.gather(*(engine.connect() for _ in range(connections)), return_exceptions=True)
+    opened = [conn for conn in results if not isinstance(conn, BaseException)]
+    for conn in opened:
+        await conn.close()
+    errors = [e for e in results if isinstance(e, BaseException)]
+    if errors:
+        raise errors[0]
+    return len(opened)
+
+SessionLocal, ReadSessionLocal = session_factories(engine, replica_engine)
 Base = declarative_base()
+
+def upsert_insert(table):
+    """INSERT supporting ON CONFLICT clauses for the configured backend (PostgreSQL, or SQLite in local runs)."""
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table)
+
+def insert_ignore(table):
+    """INSERT ... ON CONFLICT DO NOTHING."""
+    return upsert_insert(table).on_conflict_do_nothing()
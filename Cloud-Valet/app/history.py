@@ -0,0 +1,113 @@
+"""VM power-state history and incrementally maintained uptime rollups.
+
+Every inventory observation is folded into three tables in one transaction:
+
+- ``vm_power_transitions`` gets a row only when a VM's state differs from its
+  last observed state.
+- ``vm_power_states`` holds each VM's last state and ``rolled_up_to``, the
+  point up to which its uptime has already been counted.
+- ``vm_uptime_hourly`` / ``vm_uptime_daily`` get the running seconds between
+  ``rolled_up_to`` and the new observation, added to the existing buckets
+  with ``INSERT ... ON CONFLICT DO UPDATE``.
+
+Uptime queries then only read the rollup tables, however long the range.
+Between two observations a VM is assumed to stay in the state it was last
+seen in.
+"""
+import datetime
+from sqlalchemy import select
+from db import upsert_insert
+import models
+
+CHUNK_SIZE = 1000
+HOUR = datetime.timedelta(hours=1)
+
+
+def vm_key(subscription_id, resource_group, name):
+    return f"{subscription_id}/{(resource_group or '').lower()}/{(name or '').lower()}"
+
+
+def normalize_state(status):
+    # "VM running" -> "running"
+    status = (status or "unknown").strip().lower()
+    return status[3:] if status.startswith("vm ") else status
+
+
+def split_by_hour(start, end):
+    """Yield (hour start, seconds) for each hour the interval [start, end) overlaps."""
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        next_hour = hour + HOUR
+        seconds = (min(end, next_hour) - max(start, hour)).total_seconds()
+        if seconds > 0:
+            yield hour, seconds
+        hour = next_hour
+
+
+async def record_observations(session_factory, subscription_id, vms, observed_at=None):
+    """Fold one observation of ``vms`` (inventory dicts with name, resourceGroup, status) into the history."""
+    observed_at = observed_at or datetime.datetime.utcnow()
+    observed = {}
+    for vm in vms:
+        if vm.get("name") and vm.get("resourceGroup"):
+            observed[vm_key(subscription_id, vm["resourceGroup"], vm["name"])] = vm
+    if not observed:
+        return
+    current_table = models.VMPowerState.__table__
+    async with session_factory() as db:
+        current = {}
+        keys = list(observed)
+        for i in range(0, len(keys), CHUNK_SIZE):
+            # Lock the rows so concurrent recorders cannot count the same interval twice
+            query = select(current_table).where(current_table.c.vm_key.in_(keys[i:i + CHUNK_SIZE])).with_for_update()
+            for row in (await db.execute(query)).mappings():
+                current[row["vm_key"]] = row
+        transitions, states, hourly, daily = [], [], {}, {}
+        for key, vm in observed.items():
+            state = normalize_state(vm.get("status"))
+            row = current.get(key)
+            if row is not None and observed_at <= row["rolled_up_to"]:
+                # Older than what is already recorded (out-of-order observation)
+                continue
+            if row is not None and row["state"] == "running":
+                for hour, seconds in split_by_hour(row["rolled_up_to"], observed_at):
+                    bucket = (key, vm["name"], vm["resourceGroup"])
+                    hourly[bucket + (hour,)] = hourly.get(bucket + (hour,), 0) + seconds
+                    day = hour.date()
+                    daily[bucket + (day,)] = daily.get(bucket + (day,), 0) + seconds
+            changed = row is None or row["state"] != state
+            if changed:
+                transitions.append({
+                    "vm_key": key, "vm_name": vm["name"], "resource_group": vm["resourceGroup"],
+                    "state": state, "observed_at": observed_at,
+                })
+            states.append({
+                "vm_key": key, "vm_name": vm["name"], "resource_group": vm["resourceGroup"],
+                "state": state, "since": observed_at if changed else row["since"], "rolled_up_to": observed_at,
+            })
+        for i in range(0, len(transitions), CHUNK_SIZE):
+            await db.execute(models.VMPowerTransition.__table__.insert(), transitions[i:i + CHUNK_SIZE])
+        for i in range(0, len(states), CHUNK_SIZE):
+            stmt = upsert_insert(current_table).values(states[i:i + CHUNK_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[current_table.c.vm_key],
+                set_={c: stmt.excluded[c] for c in ("vm_name", "resource_group", "state", "since", "rolled_up_to")},
+            )
+            await db.execute(stmt)
+        await _add_running_seconds(db, models.VMUptimeHourly.__table__, "hour", hourly)
+        await _add_running_seconds(db, models.VMUptimeDaily.__table__, "day", daily)
+        await db.commit()
+
+
+async def _add_running_seconds(db, table, period_column, buckets):
+    rows = [
+        {"vm_key": key, "vm_name": name, "resource_group": group, period_column: period, "running_seconds": round(seconds)}
+        for (key, name, group, period), seconds in buckets.items()
+    ]
+    for i in range(0, len(rows), CHUNK_SIZE):
+        stmt = upsert_insert(table).values(rows[i:i + CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.vm_key, table.c[period_column]],
+            set_={"running_seconds": table.c.running_seconds + stmt.excluded.running_seconds},
+        )
+        await db.execute(stmt)
@@ -0,0 +1,52 @@
+"""Single-flight coalescing of VM power operations.
+
+Every power operation is keyed by (subscription, resource group, VM). If the
+operation queued last for a VM has the same action as a new request, the
+request attaches to it and shares its result instead of starting another Azure
+long-running operation. A different action is chained behind the queued one,
+so conflicting actions on the same VM always run one after the other.
+"""
+import asyncio
+
+
+class VMOperationCoalescer:
+    def __init__(self):
+        # (subscription, resource group, vm) -> (action, task) of the last queued operation
+        self._tails = {}
+
+    @staticmethod
+    def vm_key(subscription_id, resource_group, vm_name):
+        # Azure resource names are case-insensitive
+        return (subscription_id, (resource_group or "").lower(), (vm_name or "").lower())
+
+    def in_flight(self):
+        return {key + (action,) for key, (action, task) in self._tails.items() if not task.done()}
+
+    async def run(self, subscription_id, resource_group, vm_name, action, operation):
+        """Run ``operation()`` (a coroutine function) for this VM/action, or join the identical one in flight."""
+        key = self.vm_key(subscription_id, resource_group, vm_name)
+        tail = self._tails.get(key)
+        if tail is not None and tail[0] == action and not tail[1].done():
+            return await asyncio.shield(tail[1])
+        previous = tail[1] if tail is not None else None
+        task = asyncio.ensure_future(self._run_after(previous, operation))
+        self._tails[key] = (action, task)
+
+        def _cleanup(done_task):
+            current = self._tails.get(key)
+            if current is not None and current[1] is done_task:
+                del self._tails[key]
+
+        task.add_done_callback(_cleanup)
+        # Shield so a disconnected caller does not cancel an operation others are waiting on
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _run_after(previous, operation):
+        if previous is not None:
+            try:
+                await asyncio.shield(previous)
+            except Exception:
+                # The previous action failing must not block the next one
+                pass
+        return await operation()
@@ -1,19 +1,31 @@
 from fastapi import FastAPI, Depends, HTTPException, Request, Form, Cookie, Body
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
-from db import engine, Base, SessionLocal
+from db import engine, replica_engine, Base, SessionLocal, ReadSessionLocal, REPLICA_MAX_LAG, insert_ignore, use_primary, warm_pool
 import models
 from sqlalchemy.future import select
+from sqlalchemy import delete, exists, true, tuple_, update, or_, func, Date
 from starlette.status import HTTP_302_FOUND
 from passlib.context import CryptContext
 from fastapi.middleware.cors import CORSMiddleware
 from cryptography.fernet import Fernet
 import os, json, datetime
 from dotenv import load_dotenv
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
 import asyncio
+from inflight import VMOperationCoalescer
+from audit import AuditWriter
+from ratelimit import TokenBuckets, ConcurrencyBudget, RejectionCounter
+from cache import cache_from_env, get_or_refresh
+from azure_client import AzureClients
+from scheduler import PowerScheduler, CronSchedule, CronError
+from history import record_observations
+from resilience import CircuitBreakers, CircuitOpenError, is_service_failure
+from waves import WavePlan, WaveError, split_waves, run_waves
+from profiling import Profiler, ProfilingMiddleware
+from warmup import WarmUp, Skipped
+from types import SimpleNamespace
+from azure.core.exceptions import ResourceNotFoundError, ServiceRequestError, ServiceResponseError
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
@@ -29,6 +41,50 @@ app.add_middleware(
 
 load_dotenv()  # Load .env file at startup
 
+# On-demand sampling profiler (/debug/profile); while idle it costs one flag check per request
+profiler = Profiler(
+    interval=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+    max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "300")),
+)
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Who did what: VM power actions and admin changes, written in batches off the request path
+audit_log = AuditWriter(SessionLocal)
+
+# Async Azure SDK clients on one pooled aiohttp session, opened at startup and closed at shutdown
+azure_clients = AzureClients()
+AZURE_MAX_CONCURRENCY = int(os.getenv("AZURE_MAX_CONCURRENCY", "50"))
+# "subscription" pages through one subscription-wide listing; "resource_group" lists the resource groups
+# first, then each group's VMs concurrently. AZURE_RESOURCE_GROUPS limits enumeration to those groups.
+AZURE_ENUMERATION = os.getenv("AZURE_ENUMERATION", "subscription")
+AZURE_RESOURCE_GROUPS = [g.strip() for g in os.getenv("AZURE_RESOURCE_GROUPS", "").split(",") if g.strip()]
+AZURE_MAX_GROUP_CONCURRENCY = int(os.getenv("AZURE_MAX_GROUP_CONCURRENCY", "16"))
+
+# Fail fast while Azure is degraded: one breaker per (subscription, operation type), a deadline per call,
+# and reads that are re-sent if the first copy is slow
+def is_azure_failure(exc):
+    # The SDK reports transport problems (DNS, refused or reset connections) without a status code
+    return isinstance(exc, (ServiceRequestError, ServiceResponseError)) or is_service_failure(exc)
+
+azure_breakers = CircuitBreakers(
+    failure_threshold=int(os.getenv("AZURE_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("AZURE_BREAKER_RESET", "30")),
+    is_failure=is_azure_failure,
+)
+AZURE_DEADLINES = {
+    "read": float(os.getenv("AZURE_READ_TIMEOUT", "10")),
+    "list": float(os.getenv("AZURE_LIST_TIMEOUT", "60")),
+    "action": float(os.getenv("AZURE_ACTION_TIMEOUT", "900")),
+}
+AZURE_HEDGE_DELAY = float(os.getenv("AZURE_HEDGE_DELAY", "0.5"))
+
+# Shared by all workers on the host (or all nodes, with CACHE_BACKEND=redis)
+shared_cache = cache_from_env()
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+INVENTORY_CACHE_TTL = int(os.getenv("INVENTORY_CACHE_TTL", "30"))
+# How long an inventory refresh may hold the shared lock: the listing deadline plus time to store the result
+INVENTORY_LOCK_TIMEOUT = AZURE_DEADLINES["list"] + 10
+
 @app.on_event("startup")
 async def startup():
     # Create tables
@@ -55,6 +111,20 @@ async def startup():
             )
             db.add(user)
             await db.commit()
+    audit_log.start()
+    await azure_clients.start()
+    if SCHEDULER_ENABLED:
+        power_scheduler.start()
+    # Runs in the background; /health/ready answers 503 until it is done
+    warm_up.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await warm_up.stop()
+    await power_scheduler.stop()
+    await asyncio.gather(*history_tasks, return_exceptions=True)
+    await audit_log.stop()
+    await azure_clients.close()
 
 async def get_db():
     db = SessionLocal()
@@ -63,32 +133,66 @@ async def get_db():
     finally:
         await db.close()
 
+async def get_read_db():
+    # Read-only handlers: served by the replica when one is configured, until the session writes
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+async def get_auth_user(db, username):
+    """Username, email and permission for permission checks, served from the shared cache when possible."""
+    if not username:
+        return None
+    key = f"user:{username}"
+    data = await shared_cache.get(key)
+    if data is None:
+        if replica_engine is not None and await shared_cache.get(f"user:changed:{username}"):
+            # Changed within the replica's lag window: it may still have the old row
+            use_primary(db)
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        user_obj = result.scalar_one_or_none()
+        if not user_obj:
+            return None
+        data = {"username": user_obj.username, "email": user_obj.email, "permission": user_obj.permission}
+        await shared_cache.set(key, data, AUTH_CACHE_TTL)
+    return SimpleNamespace(**data)
+
+async def invalidate_auth_user(*usernames):
+    for username in usernames:
+        await shared_cache.delete(f"user:{username}")
+        if replica_engine is not None:
+            await shared_cache.set(f"user:changed:{username}", True, REPLICA_MAX_LAG)
+
 @app.get("/")
 async def root():
     return {"message": "Cloud Valet API is running!"}
 
 # User CRUD
 @app.post("/users/")
-async def create_user(username: str = Form(...), email: str = Form(...), password: str = Form(...), permission: str = Form(None), db: AsyncSession = Depends(get_db)):
+async def create_user(username: str = Form(...), email: str = Form(...), password: str = Form(...), permission: str = Form(None), user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
     existing = await db.execute(select(models.User).where(models.User.username == username))
     if existing.scalar_one_or_none():
         raise HTTPException(status_code=400, detail="Username already exists")
     if not permission:
         permission = "Read"
-    user = models.User(username=username, email=email, password_hash=pwd_context.hash(password), permission=permission)
-    db.add(user)
+    new_user = models.User(username=username, email=email, password_hash=pwd_context.hash(password), permission=permission)
+    db.add(new_user)
     await db.commit()
-    await db.refresh(user)
-    return {"username": user.username, "email": user.email, "permission": user.permission}
+    await db.refresh(new_user)
+    await invalidate_auth_user(username)
+    await audit_log.record(user, "user.create", detail={"username": username, "permission": permission})
+    return {"username": new_user.username, "email": new_user.email, "permission": new_user.permission}
 
 @app.get("/users/")
-async def list_users(db: AsyncSession = Depends(get_db)):
+async def list_users(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.User))
     users = result.scalars().all()
     return [{"username": u.username, "email": u.email, "permission": u.permission or "Read"} for u in users]
 
 @app.get("/users/me")
-async def get_current_user(user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+async def get_current_user(user: str = Cookie(None), db: AsyncSession = Depends(get_read_db)):
     print(f"/users/me: Raw cookie value received: {user!r}")
     if not user:
         print("/users/me: No user cookie found")
@@ -108,7 +212,7 @@ async def get_current_user(user: str = Cookie(None), db: AsyncSession = Depends(
     }
 
 @app.get("/users/{username}")
-async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db)):
+async def get_user_by_username(username: str, db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.User).where(models.User.username == username))
     user = result.scalar_one_or_none()
     if not user:
@@ -116,13 +220,15 @@ async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db)
     return {"username": user.username, "email": user.email, "permission": user.permission or "Read"}
 
 @app.delete("/users/{username}")
-async def delete_user(username: str, db: AsyncSession = Depends(get_db)):
+async def delete_user(username: str, user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(models.User).where(models.User.username == username))
-    user = result.scalar_one_or_none()
-    if not user:
+    user_obj = result.scalar_one_or_none()
+    if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
-    await db.delete(user)
+    await db.delete(user_obj)
     await db.commit()
+    await invalidate_auth_user(username)
+    await audit_log.record(user, "user.delete", detail={"username": username})
     return {"ok": True}
 
 @app.put("/users/{username}")
@@ -131,26 +237,29 @@ async def update_user(
     new_username: str = Form(...),
     email: str = Form(...),
     permission: str = Form(None),
+    user: str = Cookie(None),
     db: AsyncSession = Depends(get_db)
 ):
     result = await db.execute(select(models.User).where(models.User.username == username))
-    user = result.scalar_one_or_none()
-    if not user:
+    user_obj = result.scalar_one_or_none()
+    if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
     # If username is changed, check for uniqueness
     if new_username != username:
         existing = await db.execute(select(models.User).where(models.User.username == new_username))
         if existing.scalar_one_or_none():
             raise HTTPException(status_code=400, detail="Username already exists")
-        user.username = new_username
-    user.email = email
+        user_obj.username = new_username
+    user_obj.email = email
     if permission:
-        user.permission = permission
-    elif not user.permission:
-        user.permission = "Read"
+        user_obj.permission = permission
+    elif not user_obj.permission:
+        user_obj.permission = "Read"
     await db.commit()
-    await db.refresh(user)
-    return {"username": user.username, "email": user.email, "permission": user.permission}
+    await db.refresh(user_obj)
+    await invalidate_auth_user(username, new_username)
+    await audit_log.record(user, "user.update", detail={"username": username, "new_username": new_username, "permission": user_obj.permission})
+    return {"username": user_obj.username, "email": user_obj.email, "permission": user_obj.permission}
 
 # Change password
 @app.post("/users/{username}/password")
@@ -168,7 +277,7 @@ async def change_password(
     user_obj = result.scalar_one_or_none()
     if not user_obj:
         raise HTTPException(status_code=404, detail="User not found")
-    if not pwd_context.verify(old_password, user_obj.password_hash):
+    if not await verify_password(old_password, user_obj.password_hash):
         raise HTTPException(status_code=400, detail="Old password is incorrect")
     user_obj.password_hash = pwd_context.hash(new_password)
     await db.commit()
@@ -184,7 +293,7 @@ async def create_group(name: str, db: AsyncSession = Depends(get_db)):
     return group
 
 @app.get("/groups/")
-async def list_groups(db: AsyncSession = Depends(get_db)):
+async def list_groups(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.Group))
     return result.scalars().all()
 
@@ -208,7 +317,7 @@ async def create_tag(name: str, db: AsyncSession = Depends(get_db)):
     return tag
 
 @app.get("/tags/")
-async def list_tags(db: AsyncSession = Depends(get_db)):
+async def list_tags(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.Tag))
     return result.scalars().all()
 
@@ -232,7 +341,7 @@ async def create_vm(name: str, db: AsyncSession = Depends(get_db)):
     return vm
 
 @app.get("/vms/")
-async def list_vms(db: AsyncSession = Depends(get_db)):
+async def list_vms(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.VM))
     return result.scalars().all()
 
@@ -246,24 +355,183 @@ async def delete_vm(name: str, db: AsyncSession = Depends(get_db)):
     await db.commit()
     return {"ok": True}
 
+# Bulk create/delete/tag: set-based statements, one transaction per request
+BULK_CHUNK_SIZE = 1000
+
+def chunked(items, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def bulk_names(body, key="names"):
+    names = body.get(key) if body else None
+    if not isinstance(names, list) or not names:
+        raise HTTPException(status_code=400, detail=f"Missing {key}")
+    return names
+
+def bulk_outcomes(names, done, done_status, other_status):
+    # One outcome per requested item, in request order
+    outcomes, seen = [], set()
+    for name in names:
+        if not isinstance(name, str) or not name:
+            outcomes.append({"name": name, "status": "invalid"})
+        elif name in seen:
+            outcomes.append({"name": name, "status": "duplicate"})
+        else:
+            seen.add(name)
+            outcomes.append({"name": name, "status": done_status if name in done else other_status})
+    return outcomes
+
+def unique_names(names):
+    return list(dict.fromkeys(n for n in names if isinstance(n, str) and n))
+
+async def bulk_create_named(db, model, names):
+    table = model.__table__
+    created = set()
+    for chunk in chunked(unique_names(names)):
+        stmt = insert_ignore(table).values([{"name": n} for n in chunk]).returning(table.c.name)
+        result = await db.execute(stmt)
+        created.update(result.scalars().all())
+    await db.commit()
+    return bulk_outcomes(names, created, "created", "exists")
+
+async def bulk_delete_named(db, model, names, link_column):
+    table = model.__table__
+    deleted = set()
+    for chunk in chunked(unique_names(names)):
+        ids = select(table.c.id).where(table.c.name.in_(chunk))
+        await db.execute(delete(link_column.table).where(link_column.in_(ids)))
+        result = await db.execute(delete(table).where(table.c.name.in_(chunk)).returning(table.c.name))
+        deleted.update(result.scalars().all())
+    await db.commit()
+    return bulk_outcomes(names, deleted, "deleted", "not_found")
+
+@app.post("/groups/bulk_create")
+async def bulk_create_groups(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_create_named(db, models.Group, bulk_names(body))
+
+@app.post("/groups/bulk_delete")
+async def bulk_delete_groups(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_delete_named(db, models.Group, bulk_names(body), models.user_group.c.group_id)
+
+@app.post("/tags/bulk_create")
+async def bulk_create_tags(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_create_named(db, models.Tag, bulk_names(body))
+
+@app.post("/tags/bulk_delete")
+async def bulk_delete_tags(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_delete_named(db, models.Tag, bulk_names(body), models.tag_vm.c.tag_id)
+
+@app.post("/vms/bulk_create")
+async def bulk_create_vms(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_create_named(db, models.VM, bulk_names(body))
+
+@app.post("/vms/bulk_delete")
+async def bulk_delete_vms(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_delete_named(db, models.VM, bulk_names(body), models.tag_vm.c.vm_id)
+
+@app.post("/vms/bulk_tag")
+async def bulk_tag_vms(body: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    # Attach (action "add") or detach (action "remove") every given tag on every given VM
+    vm_names = bulk_names(body, "vms")
+    tag_names = unique_names(bulk_names(body, "tags"))
+    action = body.get("action", "add")
+    if action not in ("add", "remove"):
+        raise HTTPException(status_code=400, detail="Invalid action")
+    vms_table, tags_table, link = models.VM.__table__, models.Tag.__table__, models.tag_vm
+    if body.get("create_missing") and action == "add":
+        for chunk in chunked(unique_names(vm_names)):
+            await db.execute(insert_ignore(vms_table).values([{"name": n} for n in chunk]))
+        await db.execute(insert_ignore(tags_table).values([{"name": n} for n in tag_names]))
+    result = await db.execute(select(tags_table.c.id, tags_table.c.name).where(tags_table.c.name.in_(tag_names)))
+    tag_by_id = dict(result.all())
+    found, changed = {}, {}
+    for chunk in chunked(unique_names(vm_names)):
+        result = await db.execute(select(vms_table.c.id, vms_table.c.name).where(vms_table.c.name.in_(chunk)))
+        vm_by_id = dict(result.all())
+        found.update({name: vm_id for vm_id, name in vm_by_id.items()})
+        if not vm_by_id or not tag_by_id:
+            continue
+        if action == "add":
+            pairs = select(tags_table.c.id, vms_table.c.id).select_from(
+                tags_table.join(vms_table, true())
+            ).where(
+                tags_table.c.id.in_(list(tag_by_id)),
+                vms_table.c.id.in_(list(vm_by_id)),
+                ~exists().where(link.c.tag_id == tags_table.c.id, link.c.vm_id == vms_table.c.id),
+            )
+            stmt = insert_ignore(link).from_select(["tag_id", "vm_id"], pairs)
+        else:
+            stmt = delete(link).where(link.c.tag_id.in_(list(tag_by_id)), link.c.vm_id.in_(list(vm_by_id)))
+        result = await db.execute(stmt.returning(link.c.tag_id, link.c.vm_id))
+        for tag_id, vm_id in result.all():
+            changed.setdefault(vm_by_id[vm_id], []).append(tag_by_id[tag_id])
+    await db.commit()
+    done_status = "tagged" if action == "add" else "untagged"
+    outcomes = bulk_outcomes(vm_names, changed, done_status, "unchanged")
+    for outcome in outcomes:
+        if outcome["status"] == "unchanged" and outcome["name"] not in found:
+            outcome["status"] = "not_found"
+        elif outcome["status"] == done_status:
+            outcome["tags"] = sorted(changed[outcome["name"]])
+    return {
+        "vms": outcomes,
+        "missingTags": [n for n in tag_names if n not in tag_by_id.values()],
+    }
+
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "error": None})
 
+# Login admission control: attempts are throttled per username and per client IP, and
+# bcrypt verification runs in a thread pool under a global concurrency budget, so a
+# credential-stuffing burst is turned away before it costs a DB query or a hash.
+login_user_buckets = TokenBuckets(
+    rate=float(os.getenv("LOGIN_USER_RATE", "0.2")),
+    burst=float(os.getenv("LOGIN_USER_BURST", "10")),
+)
+login_ip_buckets = TokenBuckets(
+    rate=float(os.getenv("LOGIN_IP_RATE", "2")),
+    burst=float(os.getenv("LOGIN_IP_BURST", "50")),
+)
+password_verify_budget = ConcurrencyBudget(int(os.getenv("LOGIN_MAX_CONCURRENT_VERIFY", str(os.cpu_count() or 1))))
+# Rejections are only counted, and summarised in the log once a minute at most
+login_rejections = RejectionCounter()
+
+async def verify_password(password, password_hash):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, pwd_context.verify, password, password_hash)
+
+def login_rejected(request, reason, status_code, error, retry_after):
+    summary = login_rejections.add(reason)
+    if summary:
+        print(f"/login: rejected {summary}")
+    response = templates.TemplateResponse("login.html", {"request": request, "error": error}, status_code=status_code)
+    response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+    return response
+
 @app.post("/login", response_class=HTMLResponse)
 async def login(request: Request, username: str = Form(...), password: str = Form(...)):
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = login_ip_buckets.acquire(client_ip) or login_user_buckets.acquire(username)
+    if retry_after:
+        return login_rejected(request, "throttled", 429, "Too many login attempts, try again later", retry_after)
+    if not password_verify_budget.try_acquire():
+        return login_rejected(request, "over verification budget", 503, "Login is busy, try again shortly", 1)
     print(f"/login: Attempt login for username={username!r}")
-    async with SessionLocal() as db:
-        result = await db.execute(select(models.User).where(models.User.username == username))
-        user = result.scalar_one_or_none()
-        print(f"/login: DB lookup for username={username!r} result: {user}")
-        if user and pwd_context.verify(password, user.password_hash):
-            response = RedirectResponse(url="/dashboard", status_code=HTTP_302_FOUND)
-            response.set_cookie(key="user", value=username, httponly=False, samesite="lax", secure=False)
-            print(f"/login: Login successful, setting cookie user={username!r}")
-            return response
-        print(f"/login: Login failed for username={username!r}")
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
+    try:
+        async with SessionLocal() as db:
+            result = await db.execute(select(models.User).where(models.User.username == username))
+            user = result.scalar_one_or_none()
+            print(f"/login: DB lookup for username={username!r} result: {user}")
+            if user and await verify_password(password, user.password_hash):
+                response = RedirectResponse(url="/dashboard", status_code=HTTP_302_FOUND)
+                response.set_cookie(key="user", value=username, httponly=False, samesite="lax", secure=False)
+                print(f"/login: Login successful, setting cookie user={username!r}")
+                return response
+            print(f"/login: Login failed for username={username!r}")
+            return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials"})
+    finally:
+        password_verify_budget.release()
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
@@ -331,8 +599,7 @@ async def save_azure_provider(
     db: AsyncSession = Depends(get_db)
 ):
     # Only admin can save
-    result = await db.execute(select(models.User).where(models.User.username == user))
-    user_obj = result.scalar_one_or_none()
+    user_obj = await get_auth_user(db, user)
     if not user_obj or user_obj.permission != "Admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
     save_provider_secret({
@@ -340,6 +607,8 @@ async def save_azure_provider(
         "tenantId": tenant_id,
         "clientSecret": client_secret
     })
+    # Never log the secret itself
+    await audit_log.record(user, "provider.azure.update", detail={"clientId": client_id, "tenantId": tenant_id})
     # Return last_updated timestamp
     meta = {"last_updated": datetime.datetime.utcnow().isoformat() + "Z"}
     return {"ok": True, **meta}
@@ -347,8 +616,7 @@ async def save_azure_provider(
 @app.get("/provider/azure")
 async def get_azure_provider(user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
     # Only admin can get provider info (even without secret)
-    result = await db.execute(select(models.User).where(models.User.username == user))
-    user_obj = result.scalar_one_or_none()
+    user_obj = await get_auth_user(db, user)
     if not user_obj or user_obj.permission != "Admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
     secret = load_provider_secret()
@@ -363,43 +631,44 @@ async def get_azure_provider(user: str = Cookie(None), db: AsyncSession = Depend
 
 MOCK_MODE = os.environ.get("MOCK_AZURE", "0") == "1"
 
-@app.get("/azure/vms")
-async def list_azure_vms(user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
-    # Allow all authenticated users to view VMs
-    result = await db.execute(select(models.User).where(models.User.username == user))
-    user_obj = result.scalar_one_or_none()
-    if not user_obj:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    if MOCK_MODE:
-        # Return mock data
-        return {
-            "vms": [
-                {
-                    "id": "/subscriptions/mock/resourceGroups/mock-group/providers/Microsoft.Compute/virtualMachines/mock-vm1",
-                    "name": "mock-vm1",
-                    "location": "eastus",
-                    "type": "Microsoft.Compute/virtualMachines",
-                    "resourceGroup": "mock-group",
-                    "status": "VM deallocated"
-                },
-                {
-                    "id": "/subscriptions/mock/resourceGroups/mock-group/providers/Microsoft.Compute/virtualMachines/mock-vm2",
-                    "name": "mock-vm2",
-                    "location": "westus",
-                    "type": "Microsoft.Compute/virtualMachines",
-                    "resourceGroup": "mock-group",
-                    "status": "VM running"
-                },
-                {
-                    "id": "/subscriptions/mock/resourceGroups/mock-group/providers/Microsoft.Compute/virtualMachines/mock-vm3",
-                    "name": "mock-vm3",
-                    "location": "centralus",
-                    "type": "Microsoft.Compute/virtualMachines",
-                    "resourceGroup": "mock-group",
-                    "status": "VM stopped"
-                }
-            ]
-        }
+MOCK_VMS = [
+    {
+        "id": "/subscriptions/mock/resourceGroups/mock-group/providers/Microsoft.Compute/virtualMachines/mock-vm1",
+        "name": "mock-vm1",
+        "location": "eastus",
+        "type": "Microsoft.Compute/virtualMachines",
+        "resourceGroup": "mock-group",
+        "status": "VM deallocated"
+    },
+    {
+        "id": "/subscriptions/mock/resourceGroups/mock-group/providers/Microsoft.Compute/virtualMachines/mock-vm2",
+        "name": "mock-vm2",
+        "location": "westus",
+        "type": "Microsoft.Compute/virtualMachines",
+        "resourceGroup": "mock-group",
+        "status": "VM running"
+    },
+    {
+        "id": "/subscriptions/mock/resourceGroups/mock-group/providers/Microsoft.Compute/virtualMachines/mock-vm3",
+        "name": "mock-vm3",
+        "location": "centralus",
+        "type": "Microsoft.Compute/virtualMachines",
+        "resourceGroup": "mock-group",
+        "status": "VM stopped"
+    }
+]
+
+VM_ACTIONS = {
+    "start": "begin_start",
+    "deallocate": "begin_deallocate",
+    "poweroff": "begin_power_off",
+    "restart": "begin_restart",
+}
+
+# Duplicate power operations on the same VM share one Azure long-running operation
+vm_operations = VMOperationCoalescer()
+
+def azure_credentials():
     secret = load_provider_secret()
     if not secret:
         raise HTTPException(status_code=400, detail="Azure credentials not set")
@@ -409,31 +678,409 @@ async def list_azure_vms(user: str = Cookie(None), db: AsyncSession = Depends(ge
     subscription_id = os.environ.get("AZURE_SUBSCRIPTION_ID")
     if not all([client_id, tenant_id, client_secret, subscription_id]):
         raise HTTPException(status_code=400, detail="Missing Azure credentials or subscription ID")
+    return tenant_id, client_id, client_secret, subscription_id
+
+async def get_compute_client():
+    tenant_id, client_id, client_secret, subscription_id = azure_credentials()
+    compute_client = await azure_clients.compute(tenant_id, client_id, client_secret, subscription_id)
+    return compute_client, subscription_id
+
+def power_state(instance_view):
+    statuses = instance_view.statuses if hasattr(instance_view, 'statuses') else None
+    return next((s.display_status for s in statuses or [] if s.code.startswith('PowerState')), 'Unknown')
+
+async def azure_call(subscription_id, kind, operation):
+    """Run one Azure call under its breaker and deadline; reads are hedged, since they are idempotent."""
+    hedge_after = AZURE_HEDGE_DELAY if kind == "read" and AZURE_HEDGE_DELAY > 0 else None
+    return await azure_breakers.call((subscription_id, kind), operation, timeout=AZURE_DEADLINES[kind], hedge_after=hedge_after)
+
+def azure_error(e):
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=f"Azure unavailable: {e}", headers={"Retry-After": str(int(e.retry_after))})
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(status_code=504, detail="Azure API timeout")
+    return HTTPException(status_code=500, detail=f"Azure API error: {str(e)}")
+
+async def perform_vm_action(compute_client, subscription_id, resource_group, vm_name, action):
+    # Start the long-running operation, wait for it, then read back the VM state
+    async def operate():
+        poller = await getattr(compute_client.virtual_machines, VM_ACTIONS[action])(resource_group, vm_name)
+        await poller.wait()
+    await azure_call(subscription_id, "action", operate)
+    vm, instance_view = await asyncio.gather(
+        azure_call(subscription_id, "read", lambda: compute_client.virtual_machines.get(resource_group, vm_name)),
+        azure_call(subscription_id, "read", lambda: compute_client.virtual_machines.instance_view(resource_group, vm_name)),
+    )
+    status = power_state(instance_view)
+    return {
+        'name': vm.name,
+        'resourceGroup': resource_group,
+        'location': vm.location,
+        'status': status,
+    }
+
+async def run_vm_action(compute_client, subscription_id, resource_group, vm_name, action):
+    async def operation():
+        vm_data = await perform_vm_action(compute_client, subscription_id, resource_group, vm_name, action)
+        await update_cached_vm_status(subscription_id, vm_data)
+        return vm_data
+    return await vm_operations.run(subscription_id, resource_group, vm_name, action, operation)
+
+# Power-state history is written in the background, a few transactions at a time;
+# observations arriving out of order are ignored
+history_tasks = set()
+history_writers = asyncio.Semaphore(int(os.getenv("HISTORY_MAX_WRITERS", "4")))
+
+def record_power_states(subscription_id, vms):
+    """Record one batch of observed power states (a whole listing or bulk action, not one VM at a time)."""
+    async def record(observed_at):
+        try:
+            async with history_writers:
+                await record_observations(SessionLocal, subscription_id, vms, observed_at)
+        except Exception as e:
+            print(f"history: failed to record {len(vms)} observations: {e}")
+    task = asyncio.ensure_future(record(datetime.datetime.utcnow()))
+    history_tasks.add(task)
+    task.add_done_callback(history_tasks.discard)
+
+def inventory_cache_key(subscription_id):
+    return f"inventory:{subscription_id}"
+
+def last_inventory_key(subscription_id):
+    # Kept without expiry, to serve while Azure is unreachable
+    return f"inventory:last:{subscription_id}"
+
+async def inventory_resource_groups():
+    """Resource groups to enumerate one by one, or None to page through the whole subscription."""
+    if AZURE_RESOURCE_GROUPS:
+        return AZURE_RESOURCE_GROUPS
+    if AZURE_ENUMERATION != "resource_group":
+        return None
+    resource_client = await azure_clients.resources(*azure_credentials())
+    return [group.name async for group in resource_client.resource_groups.list()]
+
+async def enumerate_azure_vms(compute_client, subscription_id, resource_groups=None):
+    # Page through the subscription (or through the given resource groups in parallel),
+    # reading power states concurrently as VMs arrive
+    limit = asyncio.Semaphore(AZURE_MAX_CONCURRENCY)
+    group_limit = asyncio.Semaphore(AZURE_MAX_GROUP_CONCURRENCY)
+    async def describe(vm):
+        # Get resource group from ID
+        resource_group = vm.id.split("/")[4] if vm.id else ""
+        async with limit:
+            instance_view = await azure_call(
+                subscription_id, "read", lambda: compute_client.virtual_machines.instance_view(resource_group, vm.name))
+        return {
+            "id": vm.id,
+            "name": vm.name,
+            "location": vm.location,
+            "type": vm.type,
+            "resourceGroup": resource_group,
+            "status": power_state(instance_view)
+        }
+    tasks, listings = [], []
+    async def collect(pages):
+        async for vm in pages:
+            tasks.append(asyncio.ensure_future(describe(vm)))
+    async def collect_group(resource_group):
+        async with group_limit:
+            try:
+                await collect(compute_client.virtual_machines.list(resource_group))
+            except ResourceNotFoundError:
+                # Deleted since the groups were listed
+                pass
+    try:
+        if resource_groups is None:
+            await collect(compute_client.virtual_machines.list_all())
+        else:
+            listings = [asyncio.ensure_future(collect_group(group)) for group in resource_groups]
+            await asyncio.gather(*listings)
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in listings + tasks:
+            task.cancel()
+        raise
+
+async def load_inventory(force=False):
+    """(compute client, subscription id, VMs); in mock mode the client is None."""
+    if MOCK_MODE:
+        return None, "mock", MOCK_VMS
+    compute_client, subscription_id = await get_compute_client()
+    async def refresh_inventory():
+        async def enumerate_inventory():
+            return await enumerate_azure_vms(compute_client, subscription_id, await inventory_resource_groups())
+        vms = await azure_call(subscription_id, "list", enumerate_inventory)
+        record_power_states(subscription_id, vms)
+        await shared_cache.set(last_inventory_key(subscription_id), {"vms": vms, "asOf": datetime.datetime.utcnow().isoformat() + "Z"})
+        return vms
+    # One worker enumerates the subscription; the others read its result from the shared cache
+    # (or, if it takes too long, fail with LockTimeout and fall back to the last inventory seen)
+    vms = await get_or_refresh(
+        shared_cache, inventory_cache_key(subscription_id), INVENTORY_CACHE_TTL, refresh_inventory,
+        force=force, lock_timeout=INVENTORY_LOCK_TIMEOUT,
+    )
+    return compute_client, subscription_id, vms
+
+async def update_cached_vm_status(subscription_id, vm_data):
+    # Keep the shared inventory current after an action instead of re-enumerating the subscription.
+    # The patch keeps the entry's expiry, so the inventory is still re-listed every INVENTORY_CACHE_TTL
+    # seconds, and runs under the refresh lock so it never overwrites a newer listing or another patch.
+    key = inventory_cache_key(subscription_id)
+    async with shared_cache.lock(key, timeout=5) as locked:
+        if not locked:
+            # A refresh is under way; its listing replaces the entry shortly anyway
+            return
+        vms = await shared_cache.get(key)
+        if not vms:
+            return
+        for vm in vms:
+            if vm["name"].lower() == vm_data["name"].lower() and vm["resourceGroup"].lower() == vm_data["resourceGroup"].lower():
+                vm["status"] = vm_data["status"]
+        await shared_cache.replace(key, vms)
+
+async def execute_bulk_action(compute_client, subscription_id, vms, action, actor, audit=True):
+    """Run one action on many VMs concurrently and audit each outcome; a None client only simulates it (mock mode)."""
+    # Run all VM actions in parallel
+    async def operate_vm(vm):
+        name = vm.get("name")
+        resource_group = vm.get("resourceGroup")
+        if not (name and resource_group):
+            return {
+                'name': name,
+                'resourceGroup': resource_group,
+                'location': '',
+                'status': 'Error: Missing name or resource group',
+            }
+        if action not in VM_ACTIONS:
+            return {
+                'name': name,
+                'resourceGroup': resource_group,
+                'location': '',
+                'status': 'Error: Invalid action',
+            }
+        if compute_client is None:
+            return {'name': name, 'resourceGroup': resource_group, 'location': 'mock-loc', 'status': f'[MOCK] {action}'}
+        try:
+            return await run_vm_action(compute_client, subscription_id, resource_group, name, action)
+        except Exception as e:
+            return {
+                'name': name,
+                'resourceGroup': resource_group,
+                'location': '',
+                'status': f'Error: {str(e)}',
+            }
+    results = await asyncio.gather(*(operate_vm(vm) for vm in vms))
+    acted = [vm_result for vm_result in results if not is_failed_result(vm_result)]
+    if compute_client is not None and acted:
+        record_power_states(subscription_id, acted)
+    if audit:
+        await audit_bulk_results(actor, action, results)
+    return results
+
+async def audit_bulk_results(actor, action, results):
+    for vm_result in results:
+        failed = is_failed_result(vm_result)
+        await audit_log.record(
+            actor, f"vm.{action}", vm_result['name'], vm_result['resourceGroup'],
+            outcome="error" if failed else "ok", detail={"status": vm_result['status'], "bulk": True},
+        )
+
+# Power state a VM must reach before a rolling wave counts as healthy
+WAVE_TARGET_STATES = {
+    "start": "VM running",
+    "restart": "VM running",
+    "deallocate": "VM deallocated",
+    "poweroff": "VM stopped",
+}
+
+def is_failed_result(vm_result):
+    return str(vm_result['status']).startswith('Error:')
+
+async def wait_for_power_state(compute_client, subscription_id, results, action, plan):
+    """Poll each acted-on VM until it reaches the action's target state or ``plan.health_timeout`` passes."""
+    target = WAVE_TARGET_STATES[action]
+    loop = asyncio.get_event_loop()
+    async def settle(vm_result):
+        if compute_client is None or is_failed_result(vm_result) or vm_result['status'] == target:
+            return vm_result
+        status = vm_result['status']
+        deadline = loop.time() + plan.health_timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(min(plan.health_interval, max(deadline - loop.time(), 0)))
+            try:
+                instance_view = await azure_call(subscription_id, "read", lambda: compute_client.virtual_machines.instance_view(
+                    vm_result['resourceGroup'], vm_result['name']))
+                status = power_state(instance_view)
+            except Exception as e:
+                status = f"unknown ({e})"
+            if status == target:
+                return {**vm_result, 'status': status}
+        return {**vm_result, 'status': f"Error: not {target} after {plan.health_timeout:g}s (last state: {status})"}
+    return list(await asyncio.gather(*(settle(vm_result) for vm_result in results)))
+
+async def vm_tag_groups(db, vms):
+    """VM name (lowercased) -> its first tag in alphabetical order, for grouping waves by tag."""
+    names = {str(vm.get("name", "")).lower() for vm in vms}
+    result = await db.execute(
+        select(models.VM.name, models.Tag.name).join(models.VM.tags)
+        .where(func.lower(models.VM.name).in_(names)).order_by(models.Tag.name)
+    )
+    groups = {}
+    for vm_name, tag_name in result.all():
+        groups.setdefault(vm_name.lower(), tag_name)
+    return groups
+
+async def execute_rolling_action(compute_client, subscription_id, vms, action, actor, plan, group_of=lambda vm: None):
+    """Run a bulk action in waves (see waves.py), waiting for each wave to reach the action's target state."""
+    async def settle(results):
+        # Audit after the health check, so a VM that never becomes healthy is logged as a failure
+        results = await wait_for_power_state(compute_client, subscription_id, results, action, plan)
+        await audit_bulk_results(actor, action, results)
+        return results
+    return await run_waves(
+        split_waves(vms, plan, group_of),
+        lambda wave: execute_bulk_action(compute_client, subscription_id, wave, action, actor, audit=False),
+        settle,
+        plan,
+        is_failure=is_failed_result,
+    )
+
+# Startup warm-up: fill the DB pools, fetch an Azure token, then pre-fetch the VM inventory
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+warm_up = WarmUp(timeout=float(os.getenv("WARMUP_TIMEOUT", "120")))
+
+async def warm_db_pools():
+    connections = int(os.getenv("WARMUP_DB_CONNECTIONS", "0")) or None
+    opened = await warm_pool(engine, connections)
+    if replica_engine is not None:
+        return f"{opened} primary, {await warm_pool(replica_engine, connections)} replica connections"
+    return f"{opened} connections"
+
+def warm_up_credentials():
+    if MOCK_MODE:
+        raise Skipped("mock mode")
+    try:
+        return azure_credentials()
+    except HTTPException as e:
+        raise Skipped(e.detail)
+
+async def warm_azure_token():
+    await azure_clients.token(*warm_up_credentials())
+
+async def warm_inventory():
+    warm_up_credentials()
+    if os.getenv("WARMUP_INVENTORY", "1") != "1":
+        raise Skipped("disabled")
+    _, _, vms = await load_inventory()
+    return f"{len(vms)} VMs"
+
+if WARMUP_ENABLED:
+    warm_up.step("database", warm_db_pools)
+    warm_up.step("azure_token", warm_azure_token)
+    warm_up.step("inventory", warm_inventory, after="azure_token")
+
+@app.get("/health/live")
+async def liveness():
+    # The worker is up and its event loop is answering
+    return {"status": "alive", "worker": os.getpid()}
+
+@app.get("/health/ready")
+async def readiness():
+    # For load balancers: 200 once warm-up has finished, 503 while warming up or shutting down
+    return JSONResponse(status_code=200 if warm_up.ready else 503, content={"worker": os.getpid(), **warm_up.status()})
+
+@app.get("/azure/vms")
+async def list_azure_vms(refresh: bool = False, user: str = Cookie(None), db: AsyncSession = Depends(get_read_db)):
+    # Allow all authenticated users to view VMs
+    user_obj = await get_auth_user(db, user)
+    if not user_obj:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    if MOCK_MODE:
+        # Return mock data
+        record_power_states("mock", MOCK_VMS)
+        return {"vms": MOCK_VMS}
     try:
-        credential = ClientSecretCredential(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret)
-        compute_client = ComputeManagementClient(credential, subscription_id)
-        vms = []
-        for vm in compute_client.virtual_machines.list_all():
-            # Get resource group from ID
-            resource_group = vm.id.split("/")[4] if vm.id else ""
-            # Get power state (status)
-            instance_view = compute_client.virtual_machines.instance_view(resource_group, vm.name)
-            status = None
-            for s in instance_view.statuses:
-                if s.code.startswith("PowerState/"):
-                    status = s.display_status
-                    break
-            vms.append({
-                "id": vm.id,
-                "name": vm.name,
-                "location": vm.location,
-                "type": vm.type,
-                "resourceGroup": resource_group,
-                "status": status or "Unknown"
-            })
+        _, _, vms = await load_inventory(force=refresh)
         return {"vms": vms}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Azure API error: {str(e)}")
+        # Azure is failing or its breaker is open: fall back to the last inventory we saw, marked stale
+        last = await shared_cache.get(last_inventory_key(os.environ.get("AZURE_SUBSCRIPTION_ID")))
+        if last:
+            return {"vms": last["vms"], "stale": True, "asOf": last["asOf"], "error": str(e)}
+        raise azure_error(e)
+
+# groupBy -> labels of the grouping columns in the response
+UPTIME_GROUPS = {"vm": ["vm", "resourceGroup"], "resourceGroup": ["resourceGroup"], "tag": ["tag"]}
+UPTIME_GRANULARITIES = ("total", "day", "hour")
+
+@app.get("/azure/vms/uptime")
+async def vm_uptime(
+    groupBy: str = "vm",
+    granularity: str = "total",
+    since: datetime.datetime = None,
+    until: datetime.datetime = None,
+    vm: str = None,
+    resourceGroup: str = None,
+    tag: str = None,
+    user: str = Cookie(None),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Reads only the hourly/daily rollups, never the raw transitions
+    if not await get_auth_user(db, user):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    if groupBy not in UPTIME_GROUPS or granularity not in UPTIME_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Invalid groupBy or granularity")
+    if until is None:
+        until = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    if since is None:
+        since = until - datetime.timedelta(days=30)
+    since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None) if since.tzinfo else since
+    until = until.astimezone(datetime.timezone.utc).replace(tzinfo=None) if until.tzinfo else until
+    whole_days = since.time() == until.time() == datetime.time(0)
+    if granularity == "hour" or not whole_days:
+        rollup, period, since_key, until_key = models.VMUptimeHourly, models.VMUptimeHourly.hour, since, until
+    else:
+        rollup, period, since_key, until_key = models.VMUptimeDaily, models.VMUptimeDaily.day, since.date(), until.date()
+    group_columns = {
+        "vm": [rollup.vm_name, rollup.resource_group],
+        "resourceGroup": [rollup.resource_group],
+        "tag": [models.Tag.name],
+    }[groupBy]
+    if granularity == "day" and rollup is models.VMUptimeHourly:
+        # Bounds not at midnight: read the hours, but still report one row per day
+        group_columns = group_columns + [func.date(period, type_=Date)]
+    elif granularity != "total":
+        group_columns = group_columns + [period]
+    query = select(*group_columns, func.sum(rollup.running_seconds)).where(period >= since_key, period < until_key)
+    if groupBy == "tag" or tag:
+        query = query.join(models.VM, models.VM.name == rollup.vm_name).join(models.VM.tags)
+    if tag:
+        query = query.where(models.Tag.name == tag)
+    if vm:
+        query = query.where(rollup.vm_name == vm)
+    if resourceGroup:
+        query = query.where(rollup.resource_group == resourceGroup)
+    query = query.group_by(*group_columns).order_by(*group_columns)
+    results = []
+    for row in (await db.execute(query)).all():
+        *keys, seconds = row
+        entry = {}
+        if granularity != "total":
+            value = keys.pop()
+            entry["period"] = value.isoformat() + ("Z" if isinstance(value, datetime.datetime) else "")
+        entry.update(zip(UPTIME_GROUPS[groupBy], keys))
+        entry["runningHours"] = round((seconds or 0) / 3600, 2)
+        results.append(entry)
+    return {
+        "since": since.isoformat() + "Z",
+        "until": until.isoformat() + "Z",
+        "groupBy": groupBy,
+        "granularity": granularity,
+        "source": rollup.__tablename__,
+        "results": results,
+    }
 
 @app.post("/azure/vm/action")
 async def vm_action(
@@ -442,8 +1089,7 @@ async def vm_action(
     body: dict = Body(None)
 ):
     # Always check permission first, even if body is missing
-    result = await db.execute(select(models.User).where(models.User.username == user))
-    user_obj = result.scalar_one_or_none()
+    user_obj = await get_auth_user(db, user)
     perm = (user_obj.permission if user_obj else None) or "Read"
     if not user_obj or perm not in ("Write", "Admin"):
         # Defensive: always return 403 in MOCK_MODE, never raise any other error
@@ -458,49 +1104,19 @@ async def vm_action(
     if not (vm_name and resource_group and action):
         raise HTTPException(status_code=400, detail="Missing VM name, resource group, or action")
     if MOCK_MODE:
+        await audit_log.record(user, f"vm.{action}", vm_name, resource_group, detail={"mock": True})
         return {"ok": True, "message": f"[MOCK] {action} performed on {vm_name}"}
-    secret = load_provider_secret()
-    if not secret:
-        raise HTTPException(status_code=400, detail="Azure credentials not set")
-    client_id = secret.get("clientId")
-    tenant_id = secret.get("tenantId")
-    client_secret = secret.get("clientSecret")
-    subscription_id = os.environ.get("AZURE_SUBSCRIPTION_ID")
-    if not all([client_id, tenant_id, client_secret, subscription_id]):
-        raise HTTPException(status_code=400, detail="Missing Azure credentials or subscription ID")
+    if action not in VM_ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action")
+    compute_client, subscription_id = await get_compute_client()
     try:
-        credential = ClientSecretCredential(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret)
-        compute_client = ComputeManagementClient(credential, subscription_id)
-        if action == "start":
-            poller = compute_client.virtual_machines.begin_start(resource_group, vm_name)
-            poller.wait()
-        elif action == "deallocate":
-            poller = compute_client.virtual_machines.begin_deallocate(resource_group, vm_name)
-            poller.wait()
-        elif action == "poweroff":
-            poller = compute_client.virtual_machines.begin_power_off(resource_group, vm_name)
-            poller.wait()
-        elif action == "restart":
-            poller = compute_client.virtual_machines.begin_restart(resource_group, vm_name)
-            poller.wait()
-        else:
-            raise HTTPException(status_code=400, detail="Invalid action")
-        # After action, fetch updated VM info
-        vm = compute_client.virtual_machines.get(resource_group, vm_name)
-        instance_view = compute_client.virtual_machines.instance_view(resource_group, vm_name)
-        statuses = instance_view.statuses if hasattr(instance_view, 'statuses') else []
-        status = next((s.display_status for s in statuses if s.code.startswith('PowerState')), 'Unknown')
-        vm_data = {
-            'name': vm.name,
-            'resourceGroup': resource_group,
-            'location': vm.location,
-            'status': status,
-        }
-        return vm_data
-    except HTTPException:
-        raise
+        vm_data = await run_vm_action(compute_client, subscription_id, resource_group, vm_name, action)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Azure API error: {str(e)}")
+        await audit_log.record(user, f"vm.{action}", vm_name, resource_group, outcome="error", detail={"error": str(e)})
+        raise azure_error(e)
+    record_power_states(subscription_id, [vm_data])
+    await audit_log.record(user, f"vm.{action}", vm_name, resource_group, detail={"status": vm_data["status"]})
+    return vm_data
 
 @app.post("/azure/vms/bulk_action")
 async def vms_bulk_action(
@@ -509,80 +1125,343 @@ async def vms_bulk_action(
     body: dict = Body(...)
 ):
     # Allow Write and Admin users to perform actions
-    result = await db.execute(select(models.User).where(models.User.username == user))
-    user_obj = result.scalar_one_or_none()
+    user_obj = await get_auth_user(db, user)
     perm = (user_obj.permission if user_obj else None) or "Read"
     if not user_obj or perm not in ("Write", "Admin"):
         # If MOCK_MODE, always return a mock 403 for forbidden users
         if MOCK_MODE:
             return JSONResponse(status_code=403, content={"detail": "Write or Admin only [MOCK]"})
         raise HTTPException(status_code=403, detail="Write or Admin only")
-    if MOCK_MODE:
+    if MOCK_MODE and not body.get("waves"):
         names = body.get("names", [])
         action = body.get("action")
+        for name in names:
+            await audit_log.record(user, f"vm.{action}", name, "mock-rg", detail={"mock": True, "bulk": True})
         return [
             {"name": name, "resourceGroup": "mock-rg", "location": "mock-loc", "status": f"[MOCK] {action}"}
             for name in names
         ]
-    secret = load_provider_secret()
-    if not secret:
-        raise HTTPException(status_code=400, detail="Azure credentials not set")
-    client_id = secret.get("clientId")
-    tenant_id = secret.get("tenantId")
-    client_secret = secret.get("clientSecret")
-    subscription_id = os.environ.get("AZURE_SUBSCRIPTION_ID")
-    if not all([client_id, tenant_id, client_secret, subscription_id]):
-        raise HTTPException(status_code=400, detail="Missing Azure credentials or subscription ID")
     vms = body.get("vms", [])
     action = body.get("action")
     if not vms or not action:
         raise HTTPException(status_code=400, detail="Missing VMs or action")
-    credential = ClientSecretCredential(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret)
-    compute_client = ComputeManagementClient(credential, subscription_id)
-    # Run all VM actions in parallel
-    async def operate_vm(vm):
-        name = vm.get("name")
-        resource_group = vm.get("resourceGroup")
-        if not (name and resource_group):
-            return {
-                'name': name,
-                'resourceGroup': resource_group,
-                'location': '',
-                'status': 'Error: Missing name or resource group',
-            }
+    if body.get("waves"):
+        # Rolling mode: a few VMs at a time, each wave healthy before the next
+        if action not in VM_ACTIONS:
+            raise HTTPException(status_code=400, detail="Invalid action")
         try:
-            loop = asyncio.get_event_loop()
-            if action == "start":
-                await loop.run_in_executor(None, lambda: compute_client.virtual_machines.begin_start(resource_group, name).wait())
-            elif action == "deallocate":
-                await loop.run_in_executor(None, lambda: compute_client.virtual_machines.begin_deallocate(resource_group, name).wait())
-            elif action == "poweroff":
-                await loop.run_in_executor(None, lambda: compute_client.virtual_machines.begin_power_off(resource_group, name).wait())
-            elif action == "restart":
-                await loop.run_in_executor(None, lambda: compute_client.virtual_machines.begin_restart(resource_group, name).wait())
-            else:
-                return {
-                    'name': name,
-                    'resourceGroup': resource_group,
-                    'location': '',
-                    'status': 'Error: Invalid action',
-                }
-            vm_obj = compute_client.virtual_machines.get(resource_group, name)
-            instance_view = compute_client.virtual_machines.instance_view(resource_group, name)
-            statuses = instance_view.statuses if hasattr(instance_view, 'statuses') else []
-            status = next((s.display_status for s in statuses if s.code.startswith('PowerState')), 'Unknown')
-            return {
-                'name': vm_obj.name,
-                'resourceGroup': resource_group,
-                'location': vm_obj.location,
-                'status': status,
-            }
-        except Exception as e:
-            return {
-                'name': name,
-                'resourceGroup': resource_group,
-                'location': '',
-                'status': f'Error: {str(e)}',
+            plan = WavePlan.from_dict(body["waves"])
+        except WaveError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        group_of = lambda vm: None
+        if plan.group_by == "resourceGroup":
+            group_of = lambda vm: vm.get("resourceGroup")
+        elif plan.group_by == "tag":
+            tag_groups = await vm_tag_groups(db, vms)
+            group_of = lambda vm: tag_groups.get(str(vm.get("name", "")).lower())
+        # Mock mode simulates the actions and treats every wave as healthy
+        compute_client, subscription_id = (None, "mock") if MOCK_MODE else await get_compute_client()
+        return await execute_rolling_action(compute_client, subscription_id, vms, action, user, plan, group_of)
+    compute_client, subscription_id = await get_compute_client()
+    return await execute_bulk_action(compute_client, subscription_id, vms, action, user)
+
+@app.get("/audit")
+async def list_audit_log(
+    username: str = None,
+    vm: str = None,
+    since: datetime.datetime = None,
+    until: datetime.datetime = None,
+    limit: int = 100,
+    cursor: str = None,
+    user: str = Cookie(None),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Only admin can read the audit log
+    user_obj = await get_auth_user(db, user)
+    if not user_obj or user_obj.permission != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    limit = max(1, min(limit, 1000))
+    entry = models.AuditLog
+    query = select(entry)
+    if username:
+        query = query.where(entry.username == username)
+    if vm:
+        query = query.where(entry.vm_name == vm)
+    if since:
+        # created_at is naive UTC
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None) if since.tzinfo else since
+        query = query.where(entry.created_at >= since)
+    if until:
+        until = until.astimezone(datetime.timezone.utc).replace(tzinfo=None) if until.tzinfo else until
+        query = query.where(entry.created_at < until)
+    if cursor:
+        # Keyset pagination: cursor is "<created_at>_<id>" of the last entry on the previous page
+        try:
+            created_at, entry_id = cursor.rsplit("_", 1)
+            created_at, entry_id = datetime.datetime.fromisoformat(created_at), int(entry_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(entry.created_at, entry.id) < tuple_(created_at, entry_id))
+    query = query.order_by(entry.created_at.desc(), entry.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).scalars().all()
+    page = rows[:limit]
+    return {
+        "entries": [
+            {
+                "id": e.id,
+                "timestamp": e.created_at.isoformat() + "Z",
+                "username": e.username,
+                "action": e.action,
+                "vm": e.vm_name,
+                "resourceGroup": e.resource_group,
+                "outcome": e.outcome,
+                "detail": json.loads(e.detail) if e.detail else None,
             }
-    results = await asyncio.gather(*(operate_vm(vm) for vm in vms))
-    return results
+            for e in page
+        ],
+        "next_cursor": f"{page[-1].created_at.isoformat()}_{page[-1].id}" if len(rows) > limit else None,
+    }
+
+def profile_response(profile):
+    # Folded stacks, one "frame;frame;frame count" line per distinct stack, for flame-graph tools
+    return PlainTextResponse(profile.folded(), headers={
+        "X-Profile-Samples": str(profile.samples),
+        "X-Profile-Worker": str(os.getpid()),
+    })
+
+@app.post("/debug/profile")
+async def profile_worker(
+    seconds: float = None,
+    requests: int = None,
+    user: str = Cookie(None),
+    db: AsyncSession = Depends(get_db)
+):
+    # Only admin can profile; samples this worker only
+    user_obj = await get_auth_user(db, user)
+    if not user_obj or user_obj.permission != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    if seconds is None and requests is None:
+        seconds = 10
+    if (seconds is not None and seconds <= 0) or (requests is not None and requests < 1):
+        raise HTTPException(status_code=400, detail="seconds and requests must be positive")
+    await audit_log.record(user, "profile.worker", detail={"seconds": seconds, "requests": requests})
+    # Don't hold a pooled DB connection while sampling
+    await db.close()
+    return profile_response(await profiler.profile_worker(seconds, requests))
+
+@app.post("/debug/profile/routes")
+async def arm_route_profile(body: dict = Body(...), user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    # Profile the next `count` requests to a route, given by path or endpoint name (count 0 disarms)
+    user_obj = await get_auth_user(db, user)
+    if not user_obj or user_obj.permission != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    route = str(body.get("route") or "")
+    count = body.get("count", 1)
+    path = route if route.startswith("/") else next((r.path for r in app.routes if getattr(r, "name", None) == route), None)
+    if not path or "{" in path:
+        raise HTTPException(status_code=400, detail="route must be a path without parameters or an endpoint name")
+    if not isinstance(count, int) or not 0 <= count <= 100:
+        raise HTTPException(status_code=400, detail="count must be between 0 and 100")
+    if count:
+        profiler.arm(path, count)
+    else:
+        profiler.disarm(path)
+    await audit_log.record(user, "profile.route", detail={"path": path, "count": count})
+    return {"armed": profiler.armed}
+
+@app.get("/debug/profile/requests")
+async def list_request_profiles(user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    user_obj = await get_auth_user(db, user)
+    if not user_obj or user_obj.permission != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return {"armed": profiler.armed, "profiles": [p.summary() for p in reversed(profiler.captured)]}
+
+@app.get("/debug/profile/requests/{profile_id}")
+async def get_request_profile(profile_id: int, user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    user_obj = await get_auth_user(db, user)
+    if not user_obj or user_obj.permission != "Admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile_response(profile)
+
+# Power schedules: cron-like start/stop of VMs by name, resource group or tag
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULE_TARGET_TYPES = ("name", "resourceGroup", "tag")
+
+async def load_enabled_schedules():
+    async with SessionLocal() as db:
+        result = await db.execute(select(models.PowerSchedule).where(models.PowerSchedule.enabled == True))
+        return result.scalars().all()
+
+def schedule_matches(schedule, vm, tagged):
+    if schedule.target_type == "name":
+        return vm["name"].lower() == schedule.target.lower()
+    if schedule.target_type == "resourceGroup":
+        return vm["resourceGroup"].lower() == schedule.target.lower()
+    return vm["name"].lower() in tagged.get(schedule.target, ())
+
+async def run_due_schedules(due):
+    # Resolve the inventory before claiming anything; if that fails the firing is still claimed
+    # (so only one worker reports it) and the failure goes to the audit log
+    try:
+        compute_client, subscription_id, inventory = await load_inventory()
+        error = None
+    except Exception as e:
+        error = e
+    # Claim each firing in the DB, so only one worker runs it
+    by_time = {}
+    for schedule_id, fire_at in due:
+        by_time.setdefault(fire_at.replace(tzinfo=None), []).append(schedule_id)
+    table = models.PowerSchedule.__table__
+    schedules = []
+    async with SessionLocal() as db:
+        for fire_at, ids in by_time.items():
+            result = await db.execute(
+                update(table)
+                .where(table.c.id.in_(ids), table.c.enabled == True, or_(table.c.last_run_at == None, table.c.last_run_at < fire_at))
+                .values(last_run_at=fire_at)
+                .returning(table.c.id, table.c.name, table.c.action, table.c.target_type, table.c.target)
+            )
+            schedules.extend(result.all())
+        await db.commit()
+        tag_names = {sched.target for sched in schedules if sched.target_type == "tag"}
+        tagged = {}
+        if tag_names:
+            result = await db.execute(select(models.Tag.name, models.VM.name).join(models.Tag.vms).where(models.Tag.name.in_(tag_names)))
+            for tag_name, vm_name in result.all():
+                tagged.setdefault(tag_name, set()).add(vm_name.lower())
+    if not schedules:
+        return
+    if error is not None:
+        print(f"scheduler: could not run {[sched.name for sched in schedules]}: {error}")
+        for sched in schedules:
+            await audit_log.record(
+                "scheduler", "schedule.run", outcome="error",
+                detail={"id": sched.id, "name": sched.name, "action": sched.action, "error": str(error) or type(error).__name__},
+            )
+        return
+    # Everything due now becomes one bulk action per (subscription, action)
+    batches = {}
+    for sched in schedules:
+        batch = batches.setdefault((subscription_id, sched.action), {})
+        for vm in inventory:
+            if schedule_matches(sched, vm, tagged):
+                batch[(vm["resourceGroup"].lower(), vm["name"].lower())] = vm
+    print(f"scheduler: running {[sched.name for sched in schedules]} as {len(batches)} bulk actions")
+    await asyncio.gather(*(
+        execute_bulk_action(compute_client, sub, list(vms.values()), action, "scheduler")
+        for (sub, action), vms in batches.items() if vms
+    ))
+
+power_scheduler = PowerScheduler(
+    load_enabled_schedules,
+    run_due_schedules,
+    sync_interval=float(os.getenv("SCHEDULE_SYNC_INTERVAL", "60")),
+)
+
+def schedule_to_dict(schedule):
+    next_run = None
+    if schedule.enabled:
+        try:
+            fire_at = CronSchedule(schedule.cron, schedule.timezone).next_after(datetime.datetime.now(datetime.timezone.utc))
+            next_run = fire_at.isoformat().replace("+00:00", "Z") if fire_at else None
+        except CronError:
+            pass
+    return {
+        "id": schedule.id,
+        "name": schedule.name,
+        "cron": schedule.cron,
+        "timezone": schedule.timezone,
+        "action": schedule.action,
+        "targetType": schedule.target_type,
+        "target": schedule.target,
+        "enabled": schedule.enabled,
+        "createdBy": schedule.created_by,
+        "lastRunAt": schedule.last_run_at.isoformat() + "Z" if schedule.last_run_at else None,
+        "nextRunAt": next_run,
+    }
+
+def apply_schedule_fields(schedule, body):
+    fields = {
+        "name": "name", "cron": "cron", "timezone": "timezone", "action": "action",
+        "targetType": "target_type", "target": "target", "enabled": "enabled",
+    }
+    for key, attr in fields.items():
+        if key in body:
+            setattr(schedule, attr, body[key])
+    if not schedule.name or not schedule.target:
+        raise HTTPException(status_code=400, detail="Missing schedule name or target")
+    if schedule.action not in VM_ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action")
+    if schedule.target_type not in SCHEDULE_TARGET_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid target type")
+    schedule.timezone = schedule.timezone or "UTC"
+    try:
+        CronSchedule(schedule.cron or "", schedule.timezone)
+    except CronError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    schedule.enabled = bool(schedule.enabled)
+
+async def require_write_user(db, user):
+    user_obj = await get_auth_user(db, user)
+    perm = (user_obj.permission if user_obj else None) or "Read"
+    if not user_obj or perm not in ("Write", "Admin"):
+        raise HTTPException(status_code=403, detail="Write or Admin only")
+    return user_obj
+
+async def schedules_changed():
+    if power_scheduler.running:
+        await power_scheduler.reload()
+
+@app.get("/schedules")
+async def list_schedules(user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    if not await get_auth_user(db, user):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    result = await db.execute(select(models.PowerSchedule).order_by(models.PowerSchedule.name))
+    return [schedule_to_dict(sched) for sched in result.scalars().all()]
+
+@app.post("/schedules")
+async def create_schedule(body: dict = Body(...), user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    await require_write_user(db, user)
+    schedule = models.PowerSchedule(timezone="UTC", enabled=True, created_by=user)
+    apply_schedule_fields(schedule, body)
+    existing = await db.execute(select(models.PowerSchedule).where(models.PowerSchedule.name == schedule.name))
+    if existing.scalar_one_or_none():
+        raise HTTPException(status_code=400, detail="Schedule name already exists")
+    db.add(schedule)
+    await db.commit()
+    await db.refresh(schedule)
+    await audit_log.record(user, "schedule.create", detail=body)
+    await schedules_changed()
+    return schedule_to_dict(schedule)
+
+@app.put("/schedules/{schedule_id}")
+async def update_schedule(schedule_id: int, body: dict = Body(...), user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    await require_write_user(db, user)
+    schedule = await db.get(models.PowerSchedule, schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    if body.get("name") and body["name"] != schedule.name:
+        existing = await db.execute(select(models.PowerSchedule).where(models.PowerSchedule.name == body["name"]))
+        if existing.scalar_one_or_none():
+            raise HTTPException(status_code=400, detail="Schedule name already exists")
+    apply_schedule_fields(schedule, body)
+    await db.commit()
+    await db.refresh(schedule)
+    await audit_log.record(user, "schedule.update", detail={"id": schedule_id, **body})
+    await schedules_changed()
+    return schedule_to_dict(schedule)
+
+@app.delete("/schedules/{schedule_id}")
+async def delete_schedule(schedule_id: int, user: str = Cookie(None), db: AsyncSession = Depends(get_db)):
+    await require_write_user(db, user)
+    schedule = await db.get(models.PowerSchedule, schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    await db.delete(schedule)
+    await db.commit()
+    await audit_log.record(user, "schedule.delete", detail={"id": schedule_id, "name": schedule.name})
+    await schedules_changed()
+    return {"ok": True}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, DateTime, Date, Text, Index, Boolean
 from sqlalchemy.orm import relationship
 from db import Base
 
@@ -12,8 +12,8 @@ user_group = Table(
 tag_vm = Table(
     "tag_vm",
     Base.metadata,
-    Column("tag_id", Integer, ForeignKey("tags.id")),
-    Column("vm_id", Integer, ForeignKey("vms.id")),
+    Column("tag_id", Integer, ForeignKey("tags.id"), primary_key=True),
+    Column("vm_id", Integer, ForeignKey("vms.id"), primary_key=True),
 )
 
 class User(Base):
@@ -42,3 +42,71 @@ class VM(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     tags = relationship("Tag", secondary=tag_vm, back_populates="vms")
+
+class AuditLog(Base):
+    # Append-only: rows are only ever inserted (in batches, see audit.py)
+    __tablename__ = "audit_log"
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    username = Column(String, nullable=True)
+    action = Column(String, nullable=False)
+    vm_name = Column(String, nullable=True)
+    resource_group = Column(String, nullable=True)
+    outcome = Column(String, nullable=False, default="ok")
+    detail = Column(Text, nullable=True)
+    __table_args__ = (
+        Index("ix_audit_log_username_created_at", "username", "created_at"),
+        Index("ix_audit_log_vm_name_created_at", "vm_name", "created_at"),
+    )
+
+class PowerSchedule(Base):
+    __tablename__ = "power_schedules"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    cron = Column(String, nullable=False)  # minute hour day month weekday
+    timezone = Column(String, nullable=False, default="UTC")
+    action = Column(String, nullable=False)  # start, deallocate, poweroff or restart
+    target_type = Column(String, nullable=False)  # name, resourceGroup or tag
+    target = Column(String, nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+    created_by = Column(String, nullable=True)
+    last_run_at = Column(DateTime, nullable=True)  # UTC; claimed by one worker per firing
+
+class VMPowerTransition(Base):
+    # One row per observed change of power state, not per poll
+    __tablename__ = "vm_power_transitions"
+    id = Column(Integer, primary_key=True)
+    vm_key = Column(String, nullable=False)  # subscription/resource group/name, lower-cased
+    vm_name = Column(String, nullable=False)
+    resource_group = Column(String, nullable=False)
+    state = Column(String, nullable=False)
+    observed_at = Column(DateTime, nullable=False)
+    __table_args__ = (Index("ix_vm_power_transitions_vm_key_observed_at", "vm_key", "observed_at"),)
+
+class VMPowerState(Base):
+    # Last observed state per VM and how far its uptime has been rolled up
+    __tablename__ = "vm_power_states"
+    vm_key = Column(String, primary_key=True)
+    vm_name = Column(String, nullable=False)
+    resource_group = Column(String, nullable=False)
+    state = Column(String, nullable=False)
+    since = Column(DateTime, nullable=False)
+    rolled_up_to = Column(DateTime, nullable=False)
+
+class VMUptimeHourly(Base):
+    __tablename__ = "vm_uptime_hourly"
+    vm_key = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True, index=True)
+    vm_name = Column(String, nullable=False, index=True)
+    resource_group = Column(String, nullable=False)
+    running_seconds = Column(Integer, nullable=False, default=0)
+    __table_args__ = (Index("ix_vm_uptime_hourly_resource_group_hour", "resource_group", "hour"),)
+
+class VMUptimeDaily(Base):
+    __tablename__ = "vm_uptime_daily"
+    vm_key = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    vm_name = Column(String, nullable=False, index=True)
+    resource_group = Column(String, nullable=False)
+    running_seconds = Column(Integer, nullable=False, default=0)
+    __table_args__ = (Index("ix_vm_uptime_daily_resource_group_day", "resource_group", "day"),)
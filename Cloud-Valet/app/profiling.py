@@ -0,0 +1,217 @@
+"""On-demand sampling profiler for a live worker.
+
+Nothing runs while profiling is off: ``ProfilingMiddleware`` checks one flag
+and hands the request straight on, and there is no sampler thread.
+
+While a profile is being taken, a daemon thread wakes every ``interval``
+seconds, reads the event loop thread's stack with ``sys._current_frames()``
+and counts it. Work handed to thread pools is not sampled. Profiles come out
+in the folded-stack format (``frame;frame;frame count`` per line) read by
+flamegraph.pl, speedscope and most other flame-graph viewers.
+
+- ``profile_worker`` samples everything the worker does for the next N
+  seconds, or until N more requests have completed.
+- ``arm(path, count)`` profiles the next ``count`` requests to ``path``. A
+  request profile only counts samples taken while the request's task, or a
+  task it created, is running, so concurrent requests stay out of it.
+"""
+import asyncio
+import collections
+import itertools
+import os
+import sys
+import threading
+import time
+
+_ids = itertools.count(1)
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def folded_stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Profile:
+    def __init__(self, kind, target=None, tasks=None, max_requests=None):
+        self.id = next(_ids)
+        self.kind = kind  # "worker" or "request"
+        self.target = target
+        self.tasks = tasks  # None: count every sample; otherwise only while one of these tasks runs
+        self.max_requests = max_requests
+        self.requests = 0
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self.started_at = time.time()
+        self.seconds = None
+        self.done = asyncio.Event()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "samples": self.samples,
+            "requests": self.requests,
+            "startedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started_at)),
+            "seconds": self.seconds,
+        }
+
+
+class Profiler:
+    def __init__(self, interval=0.005, max_seconds=300.0, keep=20):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.active = False  # read by the middleware on every request
+        self.captured = collections.deque(maxlen=keep)  # finished request profiles, newest last
+        self._profiles = []
+        self._armed = {}  # path -> requests left to profile
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._loop_thread = None
+        self._previous_factory = None
+
+    @property
+    def armed(self):
+        return dict(self._armed)
+
+    def arm(self, path, count=1):
+        self._armed[path] = count
+        self._update()
+
+    def disarm(self, path):
+        self._armed.pop(path, None)
+        self._update()
+
+    def get(self, profile_id):
+        return next((p for p in self.captured if p.id == profile_id), None)
+
+    async def profile_worker(self, seconds=None, requests=None):
+        """Sample the whole worker for ``seconds`` (capped at ``max_seconds``) or until ``requests`` have completed."""
+        profile = Profile("worker", max_requests=requests)
+        self._start(profile)
+        try:
+            await asyncio.wait_for(profile.done.wait(), min(seconds or self.max_seconds, self.max_seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._finish(profile)
+        return profile
+
+    def request_started(self, path):
+        """Start a profile of the current request if ``path`` is armed (returns it, or None)."""
+        left = self._armed.get(path)
+        if not left:
+            return None
+        if left > 1:
+            self._armed[path] = left - 1
+        else:
+            del self._armed[path]
+        profile = Profile("request", target=path, tasks={asyncio.current_task()})
+        self._start(profile)
+        return profile
+
+    def request_finished(self, profile):
+        if profile is not None:
+            self._finish(profile)
+            self.captured.append(profile)
+        for other in list(self._profiles):
+            if other.max_requests:
+                other.requests += 1
+                if other.requests >= other.max_requests:
+                    other.done.set()
+        self._update()
+
+    def _start(self, profile):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+        with self._lock:
+            self._profiles.append(profile)
+        self._update()
+
+    def _finish(self, profile):
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+        profile.seconds = round(time.time() - profile.started_at, 3)
+        if profile.tasks is not None:
+            # Drop the task references; the profile may be kept for a while
+            profile.tasks = set()
+        self._update()
+
+    def _update(self):
+        with self._lock:
+            self.active = bool(self._profiles or self._armed)
+            if self._profiles and self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+            per_request = any(p.tasks is not None for p in self._profiles)
+        # Follow tasks created by profiled requests only while a request is being profiled
+        if self._loop is not None:
+            installed = self._loop.get_task_factory() == self._task_factory
+            if per_request and not installed:
+                self._previous_factory = self._loop.get_task_factory()
+                self._loop.set_task_factory(self._task_factory)
+            elif installed and not per_request:
+                self._loop.set_task_factory(self._previous_factory)
+                self._previous_factory = None
+
+    def _task_factory(self, loop, coro, context=None):
+        previous = self._previous_factory
+        if previous is not None:
+            task = previous(loop, coro) if context is None else previous(loop, coro, context=context)
+        else:
+            task = asyncio.Task(coro, loop=loop, context=context)
+        parent = asyncio.current_task(loop)
+        for profile in self._profiles:
+            if profile.tasks is not None and parent in profile.tasks:
+                profile.tasks.add(task)
+        return task
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                frame = sys._current_frames().get(self._loop_thread)
+                task = asyncio.tasks._current_tasks.get(self._loop)
+                stack = None
+                for profile in self._profiles:
+                    if profile.tasks is None or task in profile.tasks:
+                        if stack is None:
+                            stack = folded_stack(frame) if frame is not None else "(no frame)"
+                        profile.stacks[stack] += 1
+                        profile.samples += 1
+                del frame
+            time.sleep(self.interval)
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware: a single flag check per request while profiling is off."""
+
+    def __init__(self, app, profiler, exclude_prefix="/debug/profile"):
+        self.app = app
+        self.profiler = profiler
+        self.exclude_prefix = exclude_prefix
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.active or scope["type"] != "http" or scope["path"].startswith(self.exclude_prefix):
+            await self.app(scope, receive, send)
+            return
+        profile = self.profiler.request_started(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_finished(profile)
@@ -0,0 +1,96 @@
+"""Admission control for expensive, unauthenticated work such as password checks.
+
+``TokenBuckets`` keeps one token bucket per key (username, client IP) as a
+two-slot list in an insertion-ordered dict. A bucket that has been idle long
+enough to refill completely is indistinguishable from a new one, so idle
+buckets are swept out, and the least recently used ones are evicted once
+``max_keys`` is reached. Memory stays bounded even when every request carries
+a new username.
+
+``ConcurrencyBudget`` caps how many password verifications run at once and
+rejects, rather than queues, anything over the budget.
+
+``RejectionCounter`` counts turned-away requests so that a flood of them is
+logged as an occasional summary line rather than one line per request.
+"""
+import time
+from collections import Counter, OrderedDict
+
+
+class TokenBuckets:
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = float(rate)  # tokens per second
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()  # key -> [tokens, last_refill]
+        self._idle_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        self._next_sweep = clock() + self._idle_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, key, cost=1.0):
+        """Take ``cost`` tokens from ``key``'s bucket. Returns 0 on success, else seconds until enough tokens."""
+        now = self.clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0
+        return (cost - bucket[0]) / self.rate if self.rate > 0 else float("inf")
+
+    def _sweep(self, now):
+        # Buckets are kept in least-recently-used order, so stop at the first one still refilling
+        while self._buckets:
+            key, (_, last) = next(iter(self._buckets.items()))
+            if now - last < self._idle_after:
+                break
+            del self._buckets[key]
+        self._next_sweep = now + self._idle_after
+
+
+class ConcurrencyBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+
+    def try_acquire(self):
+        if self.in_use >= self.limit:
+            return False
+        self.in_use += 1
+        return True
+
+    def release(self):
+        self.in_use -= 1
+
+
+class RejectionCounter:
+    def __init__(self, interval=60.0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.counts = Counter()
+        self._since = None
+
+    def add(self, reason):
+        """Count one rejection. Returns a summary of the window once it is ``interval`` seconds old, else None."""
+        now = self.clock()
+        if self._since is None:
+            self._since = now
+        self.counts[reason] += 1
+        if now - self._since < self.interval:
+            return None
+        summary = ", ".join(f"{count} {reason}" for reason, count in sorted(self.counts.items()))
+        summary += f" in the last {now - self._since:.0f}s"
+        self.counts.clear()
+        self._since = None
+        return summary
@@ -0,0 +1,149 @@
+"""Deadlines, circuit breakers and hedged reads for calls to a remote API.
+
+``CircuitBreakers.call`` runs one operation under the breaker for its key
+(here a subscription and an operation type) with a deadline:
+
+- While a breaker is closed, calls go through. ``failure_threshold``
+  consecutive failures (errors the remote side is responsible for, or missed
+  deadlines) open it.
+- While it is open, calls fail at once with ``CircuitOpenError`` instead of
+  queueing behind a degraded service. After ``reset_timeout`` seconds a
+  single probe call is let through (half-open): success closes the breaker,
+  failure opens it again.
+
+With ``hedge_after``, an idempotent read that has not answered after that
+many seconds is sent a second time and whichever copy answers first wins, so
+one slow backend request does not set the latency of the whole page.
+"""
+import asyncio
+import time
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_service_failure(exc):
+    """Whether ``exc`` says the remote service is unhealthy: a timeout, a connection error, or a 5xx/429 answer."""
+    if isinstance(exc, CircuitOpenError):
+        # Another breaker already failed fast; that is not a new failure of this service
+        return False
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, OSError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return status is not None and (status >= 500 or status == 429)
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_call(self):
+        """Raise ``CircuitOpenError`` unless a call may go through now."""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        retry_after = max(self.reset_timeout - (self.clock() - self.opened_at), 1.0)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._probing = False
+
+    def release(self):
+        # The call ended without telling us anything (e.g. it was cancelled)
+        self._probing = False
+
+
+async def hedged(operation, delay, attempts=2):
+    """Await ``operation()``, starting another copy each ``delay`` seconds it stays unanswered (up to ``attempts``)."""
+    pending = {asyncio.ensure_future(operation())}
+    launched, error = 1, None
+    try:
+        while pending:
+            timeout = delay if launched < attempts else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not done:
+                pending.add(asyncio.ensure_future(operation()))
+                launched += 1
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class CircuitBreakers:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, is_failure=is_service_failure, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.clock = clock
+        self._breakers = {}
+
+    def get(self, key):
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            name = "/".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+            breaker = self._breakers[key] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout, self.clock)
+        return breaker
+
+    async def call(self, key, operation, timeout=None, hedge_after=None):
+        """Run ``operation()`` under the breaker for ``key``, giving up after ``timeout`` seconds."""
+        breaker = self.get(key)
+        breaker.before_call()
+        try:
+            call = hedged(operation, hedge_after) if hedge_after else operation()
+            try:
+                result = await asyncio.wait_for(call, timeout)
+            except asyncio.TimeoutError as e:
+                if str(e):
+                    raise
+                raise asyncio.TimeoutError(f"{breaker.name} timed out after {timeout:g}s") from None
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if self.is_failure(e):
+                breaker.record_failure()
+            elif getattr(e, "status_code", None) is not None:
+                # The service answered; the request itself was wrong
+                breaker.record_success()
+            else:
+                # A nested breaker failing fast, or a bug on our side: says nothing about the service
+                breaker.release()
+            raise
+        breaker.record_success()
+        return result
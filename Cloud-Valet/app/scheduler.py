@@ -0,0 +1,201 @@
+"""Cron-like, timezone-aware power schedules run by an in-process timer heap.
+
+``CronSchedule`` parses the usual five fields (minute, hour, day of month,
+month, day of week) with ``*``, lists, ranges, steps and three-letter month
+and weekday names, and computes the next firing time in the schedule's
+timezone.
+
+``PowerScheduler`` keeps one heap entry per enabled schedule and sleeps until
+the earliest one is due, so idle schedules cost nothing between firings. Every
+entry due at the same moment is handed to ``fire`` in a single call, letting
+the caller merge them into one bulk action. Schedules are re-read through
+``load`` on ``reload()`` and every ``sync_interval`` seconds, so changes made
+by other workers are picked up.
+"""
+import asyncio
+import datetime
+import heapq
+import time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+MONTH_NAMES = {name: i for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+DAY_NAMES = {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+
+class CronError(ValueError):
+    pass
+
+
+def _parse_field(field, low, high, names=None):
+    values = set()
+    for part in field.lower().split(","):
+        step, stepped = 1, "/" in part
+        if stepped:
+            part, step_text = part.split("/", 1)
+            if not step_text.isdigit() or int(step_text) < 1:
+                raise CronError(f"Invalid step in {field!r}")
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        else:
+            bounds = [names.get(p, p) if names else p for p in part.split("-", 1)]
+            try:
+                bounds = [int(b) for b in bounds]
+            except ValueError:
+                raise CronError(f"Invalid value in {field!r}")
+            start = bounds[0]
+            end = bounds[1] if len(bounds) == 2 else (high if stepped else start)
+        if not (low <= start <= high and low <= end <= high and start <= end):
+            raise CronError(f"Value out of range in {field!r}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    def __init__(self, expression, timezone="UTC"):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise CronError("Cron expression must have 5 fields: minute hour day month weekday")
+        try:
+            self.tz = ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise CronError(f"Unknown timezone {timezone!r}")
+        self.expression = expression
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+        # 7 is accepted as Sunday, like cron
+        self.weekdays = frozenset(d % 7 for d in _parse_field(fields[4], 0, 7, DAY_NAMES))
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, t):
+        day_ok = t.day in self.days
+        weekday_ok = (t.isoweekday() % 7) in self.weekdays
+        # As in cron: when both fields are restricted, either one matching is enough
+        if not self._any_day and not self._any_weekday:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, after):
+        """First firing strictly after the aware datetime ``after``, as an aware UTC datetime (or None)."""
+        t = after.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        last_year = t.year + 5
+        while t.year <= last_year:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                fire_at = t.replace(tzinfo=self.tz).astimezone(datetime.timezone.utc)
+                # Local times skipped by a DST change do not exist; move on
+                if fire_at.astimezone(self.tz).replace(tzinfo=None) == t:
+                    return fire_at
+                t += datetime.timedelta(minutes=1)
+        return None
+
+
+class PowerScheduler:
+    def __init__(self, load, fire, sync_interval=60.0, clock=time.time):
+        self.load = load  # async () -> iterable of objects with id, cron, timezone
+        self.fire = fire  # async (list of (schedule id, aware UTC fire time)) -> None
+        self.sync_interval = sync_interval
+        self.clock = clock
+        self._crons = {}
+        self._heap = []  # (fire timestamp, schedule id)
+        self._checked_until = None  # firings up to this timestamp have been handed out
+        self._wake = None
+        self._task = None
+        self._firing = set()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        tasks = list(self._firing) + ([self._task] if self.running else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    async def reload(self):
+        self.set_schedules(await self.load())
+        if self._wake is not None:
+            self._wake.set()
+
+    def set_schedules(self, schedules):
+        if self._checked_until is None:
+            self._checked_until = self.clock()
+        # Start from what has already been handed out, so a reload never skips a firing that is due
+        since = datetime.datetime.fromtimestamp(self._checked_until, datetime.timezone.utc)
+        self._crons, self._heap = {}, []
+        for schedule in schedules:
+            try:
+                cron = CronSchedule(schedule.cron, schedule.timezone or "UTC")
+            except CronError as e:
+                print(f"scheduler: skipping schedule {schedule.id}: {e}")
+                continue
+            self._crons[schedule.id] = cron
+            fire_at = cron.next_after(since)
+            if fire_at is not None:
+                self._heap.append((fire_at.timestamp(), schedule.id))
+        heapq.heapify(self._heap)
+
+    def pop_due(self, now=None):
+        """Remove and return every entry due at ``now``, re-queuing each schedule's next firing."""
+        now = self.clock() if now is None else now
+        self._checked_until = max(now, self._checked_until or now)
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            at, schedule_id = heapq.heappop(self._heap)
+            fire_at = datetime.datetime.fromtimestamp(at, datetime.timezone.utc)
+            due.append((schedule_id, fire_at))
+            next_at = self._crons[schedule_id].next_after(fire_at)
+            if next_at is not None:
+                heapq.heappush(self._heap, (next_at.timestamp(), schedule_id))
+        return due
+
+    async def _run(self):
+        next_sync = 0.0
+        while True:
+            now = self.clock()
+            if now >= next_sync:
+                try:
+                    await self.reload()
+                except Exception as e:
+                    print(f"scheduler: failed to load schedules: {e}")
+                self._wake.clear()
+                next_sync = now + self.sync_interval
+            due = self.pop_due(now)
+            if due:
+                # Run in the background so a slow bulk action does not delay later firings
+                task = asyncio.ensure_future(self._fire(due))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+                continue
+            timeout = next_sync - now
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - now)
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _fire(self, due):
+        try:
+            await self.fire(due)
+        except Exception as e:
+            print(f"scheduler: failed to run {len(due)} schedules: {e}")
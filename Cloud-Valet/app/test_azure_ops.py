@@ -0,0 +1,187 @@
+import pytest
+import asyncio
+from types import SimpleNamespace
+import main
+
+class FakePoller:
+    def __init__(self, delay):
+        self.delay = delay
+    async def wait(self):
+        await asyncio.sleep(self.delay)
+
+class FakeVirtualMachines:
+    """Async stand-in for ComputeManagementClient.virtual_machines."""
+    def __init__(self, vms, delay=0.01):
+        self.vms = vms  # (resource group, name) -> power state
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.page_delay = 0
+        self.listing = 0
+        self.max_listing = 0
+    async def _call(self, name):
+        self.calls.append(name)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+    def _vm(self, rg, name):
+        return SimpleNamespace(
+            id=f"/subscriptions/sub/resourceGroups/{rg}/providers/Microsoft.Compute/virtualMachines/{name}",
+            name=name, location="eastus", type="Microsoft.Compute/virtualMachines",
+        )
+    def list_all(self):
+        async def pages():
+            for rg, name in list(self.vms):
+                await asyncio.sleep(self.page_delay)
+                yield self._vm(rg, name)
+        return pages()
+    def list(self, resource_group):
+        async def pages():
+            self.listing += 1
+            self.max_listing = max(self.max_listing, self.listing)
+            try:
+                for rg, name in list(self.vms):
+                    if rg == resource_group:
+                        await asyncio.sleep(self.page_delay)
+                        yield self._vm(rg, name)
+            finally:
+                self.listing -= 1
+        return pages()
+    async def get(self, rg, name):
+        await self._call("get")
+        return self._vm(rg, name)
+    async def instance_view(self, rg, name):
+        await self._call("instance_view")
+        return SimpleNamespace(statuses=[
+            SimpleNamespace(code="ProvisioningState/succeeded", display_status="Provisioning succeeded"),
+            SimpleNamespace(code="PowerState/" + self.vms[(rg, name)], display_status="VM " + self.vms[(rg, name)]),
+        ])
+    def _begin(state):
+        async def begin(self, rg, name):
+            await self._call("begin")
+            self.vms[(rg, name)] = state
+            return FakePoller(self.delay)
+        return begin
+    begin_start = _begin("running")
+    begin_restart = _begin("running")
+    begin_deallocate = _begin("deallocated")
+    begin_power_off = _begin("stopped")
+
+@pytest.fixture
+def compute():
+    vms = {(f"rg{i % 3}", f"vm{i}"): "deallocated" for i in range(30)}
+    return SimpleNamespace(virtual_machines=FakeVirtualMachines(vms))
+
+@pytest.mark.asyncio
+async def test_enumerate_reads_power_states_concurrently(compute):
+    vms = await main.enumerate_azure_vms(compute, "test-sub")
+    assert len(vms) == 30
+    assert vms[4] == {
+        "id": "/subscriptions/sub/resourceGroups/rg1/providers/Microsoft.Compute/virtualMachines/vm4",
+        "name": "vm4", "location": "eastus", "type": "Microsoft.Compute/virtualMachines",
+        "resourceGroup": "rg1", "status": "VM deallocated",
+    }
+    assert compute.virtual_machines.max_in_flight > 1
+
+@pytest.mark.asyncio
+async def test_enumerate_lists_resource_groups_in_parallel(compute):
+    compute.virtual_machines.page_delay = 0.01
+    vms = await main.enumerate_azure_vms(compute, "test-sub", ["rg0", "rg1", "rg2"])
+    assert sorted(vm["name"] for vm in vms) == sorted(f"vm{i}" for i in range(30))
+    assert compute.virtual_machines.max_listing == 3
+    # Only the selected groups are listed
+    vms = await main.enumerate_azure_vms(compute, "test-sub", ["rg1"])
+    assert {vm["resourceGroup"] for vm in vms} == {"rg1"} and len(vms) == 10
+
+@pytest.mark.asyncio
+async def test_vm_action_waits_for_operation_and_reads_state(compute):
+    vm = await main.run_vm_action(compute, "test-sub", "rg0", "vm0", "start")
+    assert vm == {"name": "vm0", "resourceGroup": "rg0", "location": "eastus", "status": "VM running"}
+
+@pytest.mark.asyncio
+async def test_slow_instance_view_is_hedged(compute, monkeypatch):
+    monkeypatch.setattr(main, "AZURE_HEDGE_DELAY", 0.05)
+    vms = compute.virtual_machines
+    original = vms.instance_view
+    slow = [True]
+    async def instance_view(rg, name):
+        if slow and slow.pop():
+            await asyncio.sleep(5)
+        return await original(rg, name)
+    vms.instance_view = instance_view
+    view = await asyncio.wait_for(main.azure_call("hedge-sub", "read", lambda: vms.instance_view("rg0", "vm0")), 1)
+    assert main.power_state(view) == "VM deallocated"
+
+@pytest.mark.asyncio
+async def test_failing_actions_open_breaker_for_subscription(compute, audited):
+    class Unavailable(Exception):
+        status_code = 503
+    async def begin_start(rg, name):
+        raise Unavailable("ARM unavailable")
+    compute.virtual_machines.begin_start = begin_start
+    failures = main.azure_breakers.failure_threshold
+    for i in range(failures):
+        with pytest.raises(Unavailable):
+            await main.run_vm_action(compute, "breaker-sub", "rg0", f"vm{i}", "start")
+    # Open: the rest of a bulk action fails fast without calling Azure
+    results = await main.execute_bulk_action(
+        compute, "breaker-sub", [{"name": "vm10", "resourceGroup": "rg0"}, {"name": "vm11", "resourceGroup": "rg1"}], "start", "tester")
+    assert all(r["status"].startswith("Error: breaker-sub/action circuit open") for r in results)
+    assert len(audited) == 2
+    # Reads for the same subscription are still allowed
+    vm = await main.azure_call("breaker-sub", "read", lambda: compute.virtual_machines.get("rg0", "vm0"))
+    assert vm.name == "vm0"
+    with pytest.raises(main.HTTPException) as info:
+        raise main.azure_error(main.CircuitOpenError("breaker-sub/action", 30))
+    assert info.value.status_code == 503 and info.value.headers["Retry-After"] == "30"
+
+@pytest.mark.asyncio
+async def test_rolling_restart_waits_for_running_between_waves(compute, audited):
+    vms = compute.virtual_machines
+    # Each VM reports "starting" once after its operation before it is running
+    original = vms.instance_view
+    starting = set()
+    async def instance_view(rg, name):
+        if (rg, name) not in starting and vms.vms[(rg, name)] == "running":
+            starting.add((rg, name))
+            return main.SimpleNamespace(statuses=[main.SimpleNamespace(code="PowerState/starting", display_status="VM starting")])
+        return await original(rg, name)
+    vms.instance_view = instance_view
+    targets = [{"name": f"vm{i}", "resourceGroup": f"rg{i % 3}"} for i in range(9)]
+    plan = main.WavePlan(batch_size=2, group_by="resourceGroup", health_interval=0.01, health_timeout=1)
+    report = await main.execute_rolling_action(
+        compute, "wave-sub", targets, "start", "tester", plan, lambda vm: vm["resourceGroup"])
+    assert [(w["group"], w["vms"]) for w in report["waves"]] == [("rg0", 2), ("rg0", 1), ("rg1", 2), ("rg1", 1), ("rg2", 2), ("rg2", 1)]
+    assert all(r["status"] == "VM running" for r in report["results"])
+    assert all(w["healthSeconds"] > 0 for w in report["waves"])
+    assert not report["stopped"] and len(audited) == 9
+
+@pytest.mark.asyncio
+async def test_rolling_action_stops_when_vms_never_become_healthy(compute, audited):
+    async def instance_view(rg, name):
+        return main.SimpleNamespace(statuses=[main.SimpleNamespace(code="PowerState/starting", display_status="VM starting")])
+    compute.virtual_machines.instance_view = instance_view
+    targets = [{"name": f"vm{i}", "resourceGroup": f"rg{i % 3}"} for i in range(6)]
+    plan = main.WavePlan(batch_size=2, health_interval=0.01, health_timeout=0.05)
+    report = await main.execute_rolling_action(compute, "wave-sub-2", targets, "start", "tester", plan)
+    assert report["stopped"] and len(report["waves"]) == 1
+    assert report["results"][0]["status"] == "Error: not VM running after 0.05s (last state: VM starting)"
+    assert [vm["name"] for vm in report["skipped"]] == ["vm2", "vm3", "vm4", "vm5"]
+    # Audited once the health check has failed, not as "ok" when the action returned
+    assert [(args[2], kwargs["outcome"]) for args, kwargs in audited] == [("vm0", "error"), ("vm1", "error")]
+
+@pytest.mark.asyncio
+async def test_bulk_action_records_power_states_once(compute, audited, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(main, "record_power_states", lambda subscription_id, vms: recorded.append((subscription_id, vms)))
+    targets = [{"name": f"vm{i}", "resourceGroup": f"rg{i % 3}"} for i in range(6)] + [{"name": "vm99"}]
+    results = await main.execute_bulk_action(compute, "history-sub", targets, "start", "tester")
+    # One history write for the whole action, without the VMs that failed
+    assert len(recorded) == 1
+    assert recorded[0][0] == "history-sub"
+    assert [vm["name"] for vm in recorded[0][1]] == [r["name"] for r in results[:6]]
+    assert all(vm["status"] == "VM running" for vm in recorded[0][1])
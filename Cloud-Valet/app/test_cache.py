@@ -0,0 +1,86 @@
+import pytest
+import asyncio
+import os
+from cache import FileCache, RedisCache, LocalRedis, LockTimeout, get_or_refresh
+
+@pytest.fixture(params=["file", "redis"])
+def make_cache(request, tmp_path):
+    # Each call returns a new handle on the same shared store, like a separate worker would
+    client = LocalRedis()
+    def make():
+        if request.param == "file":
+            return FileCache(str(tmp_path))
+        return RedisCache(client)
+    return make
+
+@pytest.mark.asyncio
+async def test_set_get_delete_and_expiry(make_cache):
+    cache = make_cache()
+    assert await cache.get("k") is None
+    await cache.set("k", {"vms": [1, 2]}, ttl=60)
+    assert await make_cache().get("k") == {"vms": [1, 2]}
+    await cache.delete("k")
+    assert await cache.get("k") is None
+    await cache.set("short", "v", ttl=0.05)
+    await asyncio.sleep(0.1)
+    assert await cache.get("short") is None
+
+@pytest.mark.asyncio
+async def test_one_refresh_serves_every_worker(make_cache):
+    calls = []
+    async def refresh():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return ["vm1", "vm2"]
+    workers = [make_cache() for _ in range(4)]
+    results = await asyncio.gather(*(get_or_refresh(w, "inventory:sub", 60, refresh) for w in workers))
+    assert calls == [1]
+    assert all(r == ["vm1", "vm2"] for r in results)
+    # force bypasses the cached value
+    await get_or_refresh(workers[0], "inventory:sub", 60, refresh, force=True)
+    assert calls == [1, 1]
+
+@pytest.mark.asyncio
+async def test_slow_refresh_is_not_duplicated_when_the_lock_wait_times_out(make_cache):
+    calls = []
+    async def refresh():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return ["vm1"]
+    first, second = make_cache(), make_cache()
+    holder = asyncio.ensure_future(get_or_refresh(first, "inventory:sub", 60, refresh, lock_timeout=5))
+    await asyncio.sleep(0.05)
+    # The lock wait runs out before the refresh finishes: give up rather than refresh a second time
+    with pytest.raises(LockTimeout):
+        await get_or_refresh(second, "inventory:sub", 60, refresh, lock_timeout=0.1)
+    assert await holder == ["vm1"]
+    assert calls == [1]
+
+def test_file_cache_directory_is_private(tmp_path):
+    cache = FileCache(str(tmp_path))
+    assert os.stat(cache.directory).st_mode & 0o777 == 0o700
+    # Refuse a directory others can write to, or a symlink planted in its place
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    (shared / "cloudvalet").mkdir()
+    os.chmod(shared / "cloudvalet", 0o777)
+    with pytest.raises(RuntimeError):
+        FileCache(str(shared))
+    linked = tmp_path / "linked"
+    linked.mkdir()
+    os.symlink(cache.directory, linked / "cloudvalet")
+    with pytest.raises(RuntimeError):
+        FileCache(str(linked))
+
+@pytest.mark.asyncio
+async def test_replace_keeps_the_entry_expiry(make_cache):
+    cache = make_cache()
+    assert not await cache.replace("inventory:sub", ["vm1"])
+    assert await cache.get("inventory:sub") is None
+    await cache.set("inventory:sub", ["vm1"], ttl=0.3)
+    await asyncio.sleep(0.15)
+    assert await cache.replace("inventory:sub", ["vm1", "vm2"])
+    assert await make_cache().get("inventory:sub") == ["vm1", "vm2"]
+    # Patching does not extend the entry's life
+    await asyncio.sleep(0.2)
+    assert await cache.get("inventory:sub") is None
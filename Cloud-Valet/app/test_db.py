@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import select
+import models
+from db import session_factories, use_primary, engine_options
+
+async def group_names(db):
+    return sorted((await db.execute(select(models.Group.name))).scalars().all())
+
+@pytest.mark.asyncio
+async def test_read_sessions_use_replica_until_they_write(sqlite_db):
+    # Two local databases; the replica is behind the primary
+    primary = await sqlite_db("primary", {models.Group: [{"name": "a"}, {"name": "b"}]})
+    replica = await sqlite_db("replica", {models.Group: [{"name": "a"}]})
+    SessionLocal, ReadSessionLocal = session_factories(primary, replica)
+    async with SessionLocal() as db:
+        assert await group_names(db) == ["a", "b"]
+    async with ReadSessionLocal() as db:
+        assert await group_names(db) == ["a"]
+        db.add(models.Group(name="c"))
+        await db.flush()
+        # Read your writes: the session now stays on the primary
+        assert await group_names(db) == ["a", "b", "c"]
+        await db.commit()
+        assert await group_names(db) == ["a", "b", "c"]
+    async with ReadSessionLocal() as db:
+        assert await group_names(db) == ["a"]
+        use_primary(db)
+        assert await group_names(db) == ["a", "b", "c"]
+    # Without a replica, read sessions use the primary
+    SessionLocal, ReadSessionLocal = session_factories(primary)
+    async with ReadSessionLocal() as db:
+        assert await group_names(db) == ["a", "b", "c"]
+
+def test_engine_options_from_environment(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_REPLICA_POOL_SIZE", "40")
+    monkeypatch.setenv("DB_STATEMENT_CACHE_SIZE", "0")
+    primary = engine_options("postgresql+asyncpg://u:p@primary/db")
+    replica = engine_options("postgresql+asyncpg://u:p@replica/db", "DB_REPLICA_")
+    assert (primary["pool_size"], primary["max_overflow"], primary["echo"]) == (20, 0, False)
+    # Replica settings fall back to the primary's
+    assert (replica["pool_size"], replica["max_overflow"]) == (40, 0)
+    assert replica["connect_args"] == {"prepared_statement_cache_size": 0}
+    assert "pool_size" not in engine_options("sqlite+aiosqlite:///:memory:")
@@ -0,0 +1,42 @@
+import pytest
+import datetime
+from history import split_by_hour, normalize_state, vm_key
+
+def test_split_by_hour_spreads_interval_over_buckets():
+    start = datetime.datetime(2026, 10, 18, 22, 45)
+    end = datetime.datetime(2026, 10, 19, 1, 15)
+    assert list(split_by_hour(start, end)) == [
+        (datetime.datetime(2026, 10, 18, 22), 900),
+        (datetime.datetime(2026, 10, 18, 23), 3600),
+        (datetime.datetime(2026, 10, 19, 0), 3600),
+        (datetime.datetime(2026, 10, 19, 1), 900),
+    ]
+    assert list(split_by_hour(end, end)) == []
+
+def test_state_and_key_normalisation():
+    assert normalize_state("VM running") == "running"
+    assert normalize_state("VM deallocated") == "deallocated"
+    assert normalize_state(None) == "unknown"
+    assert vm_key("sub", "My-RG", "VM1") == "sub/my-rg/vm1"
+
+@pytest.mark.asyncio
+async def test_daily_uptime_from_hourly_rollup_is_grouped_per_day(main_db, monkeypatch):
+    import main, models
+    from types import SimpleNamespace
+    SessionLocal = await main_db({models.VMUptimeHourly: [
+        {"vm_key": "sub/rg/vm1", "vm_name": "vm1", "resource_group": "rg", "hour": hour, "running_seconds": 1800}
+        for hour in (datetime.datetime(2026, 10, 1, 13), datetime.datetime(2026, 10, 1, 14),
+                     datetime.datetime(2026, 10, 2, 9), datetime.datetime(2026, 10, 2, 10))
+    ]})
+    async def get_auth_user(db, username):
+        return SimpleNamespace(username=username, permission="Read")
+    monkeypatch.setattr(main, "get_auth_user", get_auth_user)
+    async with SessionLocal() as db:
+        data = await main.vm_uptime(
+            groupBy="vm", granularity="day", since=datetime.datetime(2026, 10, 1, 12),
+            until=datetime.datetime(2026, 10, 3), vm=None, resourceGroup=None, tag=None, user="reader", db=db)
+    assert data["source"] == "vm_uptime_hourly"
+    assert data["results"] == [
+        {"period": "2026-10-01", "vm": "vm1", "resourceGroup": "rg", "runningHours": 1.0},
+        {"period": "2026-10-02", "vm": "vm1", "resourceGroup": "rg", "runningHours": 1.0},
+    ]
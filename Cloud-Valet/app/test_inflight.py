@@ -0,0 +1,58 @@
+import pytest
+import asyncio
+from inflight import VMOperationCoalescer
+
+@pytest.mark.asyncio
+async def test_duplicate_actions_share_one_operation():
+    coalescer = VMOperationCoalescer()
+    calls = []
+    async def start():
+        calls.append("start")
+        await asyncio.sleep(0.05)
+        return {"status": "VM running"}
+    results = await asyncio.gather(
+        coalescer.run("sub", "rg", "vm1", "start", start),
+        coalescer.run("sub", "RG", "VM1", "start", start),
+        coalescer.run("sub", "rg", "vm1", "start", start),
+    )
+    assert calls == ["start"]
+    assert all(r == {"status": "VM running"} for r in results)
+    assert coalescer.in_flight() == set()
+
+@pytest.mark.asyncio
+async def test_conflicting_actions_are_serialised():
+    coalescer = VMOperationCoalescer()
+    events = []
+    def op(action):
+        async def run():
+            events.append(f"{action}-begin")
+            await asyncio.sleep(0.02)
+            events.append(f"{action}-end")
+            return action
+        return run
+    results = await asyncio.gather(
+        coalescer.run("sub", "rg", "vm1", "start", op("start")),
+        coalescer.run("sub", "rg", "vm1", "deallocate", op("deallocate")),
+        coalescer.run("sub", "rg", "vm2", "start", op("start2")),
+    )
+    assert results == ["start", "deallocate", "start2"]
+    assert events.index("start-end") < events.index("deallocate-begin")
+    # Other VMs are not held back
+    assert events.index("start2-begin") < events.index("start-end")
+
+@pytest.mark.asyncio
+async def test_failure_is_shared_and_does_not_block_next_action():
+    coalescer = VMOperationCoalescer()
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+    async def ok():
+        return "ok"
+    results = await asyncio.gather(
+        coalescer.run("sub", "rg", "vm1", "start", fail),
+        coalescer.run("sub", "rg", "vm1", "start", fail),
+        coalescer.run("sub", "rg", "vm1", "restart", ok),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], RuntimeError) and results[1] is results[0]
+    assert results[2] == "ok"
@@ -178,3 +178,74 @@ def test_provider_admin_only():
         cookies = dict(resp.cookies)
         r2 = c.get("/provider/azure", cookies=cookies)
         assert r2.status_code == 403
+
+@pytest.mark.asyncio
+async def test_bulk_create_tag_and_delete():
+    async with httpx.AsyncClient(base_url=BASE_URL) as ac:
+        vm_names = [f"bulkvm{i}" for i in range(50)]
+        await ac.post("/vms/bulk_delete", json={"names": vm_names})
+        await ac.post("/tags/bulk_delete", json={"names": ["bulktag1", "bulktag2"]})
+        # Create VMs in one request, reporting existing and duplicate names
+        r = await ac.post("/vms/bulk_create", json={"names": vm_names[:40]})
+        assert r.status_code == 200
+        assert all(o["status"] == "created" for o in r.json())
+        r = await ac.post("/vms/bulk_create", json={"names": vm_names + ["bulkvm0", ""]})
+        statuses = [o["status"] for o in r.json()]
+        assert statuses[:40] == ["exists"] * 40
+        assert statuses[40:50] == ["created"] * 10
+        assert statuses[50:] == ["duplicate", "invalid"]
+        r = await ac.post("/tags/bulk_create", json={"names": ["bulktag1"]})
+        assert r.json() == [{"name": "bulktag1", "status": "created"}]
+        # Tag the whole fleet in one round trip
+        r = await ac.post("/vms/bulk_tag", json={"vms": vm_names + ["nosuchvm"], "tags": ["bulktag1", "nosuchtag"]})
+        assert r.status_code == 200
+        data = r.json()
+        assert data["missingTags"] == ["nosuchtag"]
+        assert all(o["status"] == "tagged" and o["tags"] == ["bulktag1"] for o in data["vms"][:50])
+        assert data["vms"][50]["status"] == "not_found"
+        # Tagging again is a no-op
+        r = await ac.post("/vms/bulk_tag", json={"vms": vm_names[:5], "tags": ["bulktag1"]})
+        assert all(o["status"] == "unchanged" for o in r.json()["vms"])
+        # create_missing creates unknown tags and VMs on the fly
+        r = await ac.post("/vms/bulk_tag", json={"vms": ["bulkvm0"], "tags": ["bulktag2"], "create_missing": True})
+        assert r.json()["vms"][0] == {"name": "bulkvm0", "status": "tagged", "tags": ["bulktag2"]}
+        r = await ac.post("/vms/bulk_tag", json={"vms": vm_names[:10], "tags": ["bulktag1"], "action": "remove"})
+        assert all(o["status"] == "untagged" for o in r.json()["vms"])
+        # Deleting tagged VMs and tags also drops their links
+        r = await ac.post("/tags/bulk_delete", json={"names": ["bulktag1", "bulktag2", "nosuchtag"]})
+        assert [o["status"] for o in r.json()] == ["deleted", "deleted", "not_found"]
+        r = await ac.post("/vms/bulk_delete", json={"names": vm_names})
+        assert all(o["status"] == "deleted" for o in r.json())
+        r = await ac.get("/vms/")
+        assert not any(v["name"] in vm_names for v in r.json())
+        # Missing names is a client error
+        r = await ac.post("/groups/bulk_create", json={})
+        assert r.status_code == 400
+
+@pytest.mark.asyncio
+async def test_login_flood_is_throttled_per_username():
+    async with httpx.AsyncClient(base_url=BASE_URL) as ac:
+        statuses = []
+        for _ in range(15):
+            r = await ac.post("/login", data={"username": "flooduser", "password": "wrong"}, follow_redirects=False)
+            statuses.append(r.status_code)
+        # The burst is allowed through, the rest is rejected before any password check
+        assert statuses[0] == 200
+        assert statuses[-1] == 429
+        assert int(r.headers["Retry-After"]) >= 1
+        # Other usernames are unaffected
+        r = await ac.post("/login", data={"username": "admin", "password": "admin123"}, follow_redirects=False)
+        assert r.status_code in (302, 307)
+
+@pytest.mark.asyncio
+async def test_health_endpoints_report_warm_up():
+    async with httpx.AsyncClient(base_url=BASE_URL) as ac:
+        r = await ac.get("/health/live")
+        assert r.status_code == 200 and r.json()["status"] == "alive"
+        r = await ac.get("/health/ready")
+        assert r.status_code == 200
+        steps = r.json()["steps"]
+        assert r.json()["state"] == "ready"
+        assert steps["database"]["state"] == "done"
+        # Mock mode has no Azure to warm up
+        assert steps["azure_token"]["state"] == "skipped" and steps["inventory"]["state"] == "skipped"
@@ -2,6 +2,7 @@ import pytest
 import httpx
 import os
 import time
+import datetime
 
 BASE_URL = "http://127.0.0.1:8000"
 
@@ -88,3 +89,135 @@ def test_notifications_and_sorting(admin_cookies):
     vms = r.json().get("vms", [])
     names = [vm["name"] for vm in vms]
     assert names == sorted(names) or True  # Accept any order for now
+
+def unique_vm_name(prefix):
+    # Audit entries outlive a test run; a fresh name keeps earlier runs' entries out of the results
+    return f"{prefix}-{time.time_ns()}"
+
+def test_audit_log_records_vm_actions(admin_cookies, write_cookies, read_cookies):
+    vm_name = unique_vm_name("audit-vm")
+    payload = {"name": vm_name, "resourceGroup": "mock-group", "action": "deallocate"}
+    r = httpx.post(f"{BASE_URL}/azure/vm/action", json=payload, cookies=write_cookies)
+    assert r.status_code == 200
+    # Entries are written in batches; give the writer time to flush
+    for _ in range(20):
+        r = httpx.get(f"{BASE_URL}/audit", params={"vm": vm_name, "username": "writeuser"}, cookies=admin_cookies)
+        assert r.status_code == 200
+        if r.json()["entries"]:
+            break
+        time.sleep(0.25)
+    entry = r.json()["entries"][0]
+    assert entry["action"] == "vm.deallocate"
+    assert entry["resourceGroup"] == "mock-group"
+    # Only admins may read the audit log
+    r = httpx.get(f"{BASE_URL}/audit", cookies=read_cookies)
+    assert r.status_code == 403
+
+def test_audit_log_pagination(admin_cookies):
+    vm_name = unique_vm_name("audit-page-vm")
+    for i in range(3):
+        httpx.post(f"{BASE_URL}/azure/vm/action", json={"name": vm_name, "resourceGroup": "mock-group", "action": "start"}, cookies=admin_cookies)
+    time.sleep(1.5)
+    r = httpx.get(f"{BASE_URL}/audit", params={"vm": vm_name, "limit": 2}, cookies=admin_cookies)
+    first = r.json()
+    assert len(first["entries"]) == 2 and first["next_cursor"]
+    r = httpx.get(f"{BASE_URL}/audit", params={"vm": vm_name, "limit": 2, "cursor": first["next_cursor"]}, cookies=admin_cookies)
+    second = r.json()
+    assert len(second["entries"]) == 1 and second["next_cursor"] is None
+    assert not {e["id"] for e in first["entries"]} & {e["id"] for e in second["entries"]}
+
+def test_audit_log_time_bounds_respect_utc_offset(admin_cookies):
+    vm_name = unique_vm_name("audit-tz-vm")
+    httpx.post(f"{BASE_URL}/azure/vm/action", json={"name": vm_name, "resourceGroup": "mock-group", "action": "start"}, cookies=admin_cookies)
+    time.sleep(1.5)
+    entry = httpx.get(f"{BASE_URL}/audit", params={"vm": vm_name}, cookies=admin_cookies).json()["entries"][0]
+    created_at = datetime.datetime.fromisoformat(entry["timestamp"].rstrip("Z")).replace(tzinfo=datetime.timezone.utc)
+    # The same instant written with a +02:00 offset
+    bound = created_at.astimezone(datetime.timezone(datetime.timedelta(hours=2)))
+    r = httpx.get(f"{BASE_URL}/audit", params={"vm": vm_name, "since": bound.isoformat()}, cookies=admin_cookies)
+    assert [e["id"] for e in r.json()["entries"]] == [entry["id"]]
+    r = httpx.get(f"{BASE_URL}/audit", params={"vm": vm_name, "until": bound.isoformat()}, cookies=admin_cookies)
+    assert r.json()["entries"] == []
+
+def test_power_schedule_crud(write_cookies, read_cookies):
+    payload = {"name": "test-dev-stop", "cron": "0 19 * * mon-fri", "timezone": "Europe/Amsterdam",
+               "action": "deallocate", "targetType": "resourceGroup", "target": "mock-group"}
+    for s in httpx.get(f"{BASE_URL}/schedules", cookies=write_cookies).json():
+        if s["name"] == payload["name"]:
+            httpx.delete(f"{BASE_URL}/schedules/{s['id']}", cookies=write_cookies)
+    # Read users cannot create schedules
+    r = httpx.post(f"{BASE_URL}/schedules", json=payload, cookies=read_cookies)
+    assert r.status_code == 403
+    r = httpx.post(f"{BASE_URL}/schedules", json=payload, cookies=write_cookies)
+    assert r.status_code == 200
+    schedule = r.json()
+    assert schedule["enabled"] is True and schedule["nextRunAt"]
+    # Duplicate names and bad cron/timezone/action are rejected
+    assert httpx.post(f"{BASE_URL}/schedules", json=payload, cookies=write_cookies).status_code == 400
+    for bad in ({"cron": "0 25 * * *"}, {"timezone": "Nowhere/Land"}, {"action": "explode"}, {"targetType": "owner"}):
+        r = httpx.post(f"{BASE_URL}/schedules", json={**payload, "name": "test-bad", **bad}, cookies=write_cookies)
+        assert r.status_code == 400
+    r = httpx.put(f"{BASE_URL}/schedules/{schedule['id']}", json={"enabled": False}, cookies=write_cookies)
+    assert r.status_code == 200
+    assert r.json()["enabled"] is False and r.json()["nextRunAt"] is None
+    r = httpx.get(f"{BASE_URL}/schedules", cookies=read_cookies)
+    assert any(s["name"] == "test-dev-stop" for s in r.json())
+    r = httpx.delete(f"{BASE_URL}/schedules/{schedule['id']}", cookies=write_cookies)
+    assert r.status_code == 200
+
+def test_uptime_rollups_from_observed_power_states(read_cookies):
+    # Two observations of the mock inventory: mock-vm2 is running in between
+    httpx.get(f"{BASE_URL}/azure/vms", cookies=read_cookies)
+    time.sleep(1.5)
+    httpx.get(f"{BASE_URL}/azure/vms", cookies=read_cookies)
+    time.sleep(0.5)
+    r = httpx.get(f"{BASE_URL}/azure/vms/uptime", params={"groupBy": "vm", "granularity": "hour"}, cookies=read_cookies)
+    assert r.status_code == 200
+    data = r.json()
+    assert data["source"] == "vm_uptime_hourly"
+    assert any(e["vm"] == "mock-vm2" and e["period"] for e in data["results"])
+    # Deallocated VMs accrue no uptime
+    assert not any(e["vm"] == "mock-vm1" for e in data["results"])
+    r = httpx.get(f"{BASE_URL}/azure/vms/uptime", params={"groupBy": "resourceGroup"}, cookies=read_cookies)
+    assert r.json()["source"] == "vm_uptime_daily"
+    assert [e["resourceGroup"] for e in r.json()["results"]] == ["mock-group"]
+    r = httpx.get(f"{BASE_URL}/azure/vms/uptime", params={"groupBy": "owner"}, cookies=read_cookies)
+    assert r.status_code == 400
+    r = httpx.get(f"{BASE_URL}/azure/vms/uptime")
+    assert r.status_code == 401
+
+def test_bulk_action_rolling_waves(write_cookies):
+    vms = [{"name": f"mock-vm{i}", "resourceGroup": "mock-group" if i < 3 else "other-group"} for i in range(1, 6)]
+    payload = {"vms": vms, "action": "restart", "waves": {"batchSize": 2, "groupBy": "resourceGroup", "delay": 0.1}}
+    r = httpx.post(f"{BASE_URL}/azure/vms/bulk_action", json=payload, cookies=write_cookies)
+    assert r.status_code == 200
+    report = r.json()
+    assert [(w["group"], w["vms"]) for w in report["waves"]] == [("mock-group", 2), ("other-group", 2), ("other-group", 1)]
+    assert len(report["results"]) == 5 and not report["stopped"]
+    payload["waves"] = {"batchPercent": 0}
+    r = httpx.post(f"{BASE_URL}/azure/vms/bulk_action", json=payload, cookies=write_cookies)
+    assert r.status_code == 400
+
+def test_profile_endpoints_admin_only(write_cookies):
+    r = httpx.post(f"{BASE_URL}/debug/profile", params={"seconds": 0.1}, cookies=write_cookies)
+    assert r.status_code == 403
+    r = httpx.get(f"{BASE_URL}/debug/profile/requests", cookies=write_cookies)
+    assert r.status_code == 403
+
+def test_worker_and_route_profiles(admin_cookies, read_cookies):
+    r = httpx.post(f"{BASE_URL}/debug/profile", params={"seconds": 0.3}, cookies=admin_cookies)
+    assert r.status_code == 200
+    assert int(r.headers["X-Profile-Samples"]) > 0
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in r.text.splitlines())
+    # Profile the next request to list_azure_vms
+    r = httpx.post(f"{BASE_URL}/debug/profile/routes", json={"route": "list_azure_vms"}, cookies=admin_cookies)
+    assert r.status_code == 200 and r.json()["armed"] == {"/azure/vms": 1}
+    assert httpx.get(f"{BASE_URL}/azure/vms", cookies=read_cookies).status_code == 200
+    r = httpx.get(f"{BASE_URL}/debug/profile/requests", cookies=admin_cookies)
+    assert r.json()["armed"] == {}
+    latest = r.json()["profiles"][0]
+    assert latest["kind"] == "request" and latest["target"] == "/azure/vms"
+    r = httpx.get(f"{BASE_URL}/debug/profile/requests/{latest['id']}", cookies=admin_cookies)
+    assert r.status_code == 200
+    r = httpx.post(f"{BASE_URL}/debug/profile/routes", json={"route": "/schedules/{schedule_id}"}, cookies=admin_cookies)
+    assert r.status_code == 400
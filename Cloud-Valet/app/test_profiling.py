@@ -0,0 +1,72 @@
+import pytest
+import asyncio
+import time
+from profiling import Profiler
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+async def profiled_handler(profiler):
+    profile = profiler.request_started("/slow")
+    async def child():
+        spin(0.05)
+    await asyncio.ensure_future(child())
+    for _ in range(5):
+        spin(0.01)
+        await asyncio.sleep(0)
+    profiler.request_finished(profile)
+    return profile
+
+async def other_request():
+    for _ in range(5):
+        spin(0.01)
+        await asyncio.sleep(0)
+
+@pytest.mark.asyncio
+async def test_worker_profile_samples_event_loop():
+    profiler = Profiler(interval=0.001)
+    assert not profiler.active
+    async def busy():
+        await asyncio.sleep(0.01)
+        spin(0.1)
+    task = asyncio.ensure_future(busy())
+    profile = await profiler.profile_worker(seconds=0.2)
+    await task
+    lines = profile.folded().splitlines()
+    assert profile.samples > 0 and lines
+    assert any("busy (test_profiling.py" in line and "spin (test_profiling.py" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert not profiler.active
+
+@pytest.mark.asyncio
+async def test_request_profile_counts_only_its_own_tasks():
+    profiler = Profiler(interval=0.001)
+    profiler.arm("/slow")
+    loop = asyncio.get_running_loop()
+    factory = loop.get_task_factory()
+    profile, _ = await asyncio.gather(profiled_handler(profiler), other_request())
+    folded = profile.folded()
+    assert "child (test_profiling.py" in folded
+    assert "profiled_handler (test_profiling.py" in folded
+    assert "other_request" not in folded
+    # Disarmed after one request, and the task factory is restored
+    assert profiler.armed == {} and not profiler.active
+    assert loop.get_task_factory() is factory
+    assert profiler.get(profile.id) is profile
+
+@pytest.mark.asyncio
+async def test_worker_profile_ends_after_n_requests():
+    profiler = Profiler(interval=0.001)
+    async def requests():
+        await asyncio.sleep(0.01)
+        for _ in range(3):
+            profiler.request_finished(profiler.request_started("/fast"))
+    task = asyncio.ensure_future(requests())
+    started = time.monotonic()
+    profile = await profiler.profile_worker(seconds=5, requests=3)
+    await task
+    assert profile.requests == 3
+    assert time.monotonic() - started < 1
@@ -0,0 +1,43 @@
+from ratelimit import TokenBuckets, ConcurrencyBudget, RejectionCounter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_burst_and_refill():
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=1, burst=3, clock=clock)
+    assert [buckets.acquire("alice") for _ in range(3)] == [0, 0, 0]
+    assert buckets.acquire("alice") == 1.0
+    # Keys are independent
+    assert buckets.acquire("bob") == 0
+    clock.now = 2.0
+    assert buckets.acquire("alice") == 0
+
+def test_idle_buckets_expire_and_size_is_bounded():
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=1, burst=2, max_keys=3, clock=clock)
+    for key in ("a", "b", "c", "d"):
+        buckets.acquire(key)
+    assert len(buckets) == 3
+    clock.now = 10.0
+    buckets.acquire("e")
+    assert len(buckets) == 1
+
+def test_concurrency_budget_rejects_over_limit():
+    budget = ConcurrencyBudget(2)
+    assert budget.try_acquire() and budget.try_acquire()
+    assert not budget.try_acquire()
+    budget.release()
+    assert budget.try_acquire()
+
+def test_rejections_are_summarised_once_per_interval():
+    clock = FakeClock()
+    rejections = RejectionCounter(interval=60, clock=clock)
+    assert [rejections.add("throttled") for _ in range(1000)] == [None] * 1000
+    rejections.add("over verification budget")
+    clock.now = 61.0
+    assert rejections.add("throttled") == "1 over verification budget, 1001 throttled in the last 61s"
+    assert rejections.add("throttled") is None
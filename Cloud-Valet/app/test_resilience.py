@@ -0,0 +1,100 @@
+import pytest
+import asyncio
+from resilience import CircuitBreakers, CircuitOpenError, hedged
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class ServerError(Exception):
+    status_code = 503
+
+class NotFound(Exception):
+    status_code = 404
+
+async def fail(exc):
+    raise exc
+
+async def ok():
+    return "ok"
+
+@pytest.mark.asyncio
+async def test_breaker_opens_fails_fast_and_recovers_after_probe():
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=3, reset_timeout=30, clock=clock)
+    key = ("sub", "read")
+    for _ in range(3):
+        with pytest.raises(ServerError):
+            await breakers.call(key, lambda: fail(ServerError()))
+    with pytest.raises(CircuitOpenError) as info:
+        await breakers.call(key, ok)
+    assert info.value.retry_after == 30
+    # Other subscriptions and operation types are unaffected
+    assert await breakers.call(("sub", "action"), ok) == "ok"
+    clock.now = 31
+    # Half-open: one failing probe opens the breaker again
+    with pytest.raises(ServerError):
+        await breakers.call(key, lambda: fail(ServerError()))
+    with pytest.raises(CircuitOpenError):
+        await breakers.call(key, ok)
+    clock.now = 62
+    assert await breakers.call(key, ok) == "ok"
+    assert breakers.get(key).state == "closed"
+
+@pytest.mark.asyncio
+async def test_client_errors_do_not_open_breaker():
+    breakers = CircuitBreakers(failure_threshold=1)
+    for _ in range(3):
+        with pytest.raises(NotFound):
+            await breakers.call("k", lambda: fail(NotFound()))
+    assert await breakers.call("k", ok) == "ok"
+
+@pytest.mark.asyncio
+async def test_nested_open_breaker_and_bugs_do_not_count():
+    breakers = CircuitBreakers(failure_threshold=1)
+    with pytest.raises(ServerError):
+        await breakers.call("inner", lambda: fail(ServerError()))
+    # A listing whose per-VM reads hit the open inner breaker fails fast without tripping the outer one
+    async def listing():
+        return await breakers.call("inner", ok)
+    for _ in range(3):
+        with pytest.raises(CircuitOpenError):
+            await breakers.call("outer", listing)
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            await breakers.call("outer", lambda: fail(KeyError("status")))
+    assert breakers.get("outer").state == "closed"
+
+@pytest.mark.asyncio
+async def test_deadline_counts_as_failure():
+    breakers = CircuitBreakers(failure_threshold=1)
+    with pytest.raises(asyncio.TimeoutError, match="slow timed out after 0.05s"):
+        await breakers.call("slow", lambda: asyncio.sleep(1), timeout=0.05)
+    with pytest.raises(CircuitOpenError):
+        await breakers.call("slow", ok)
+
+@pytest.mark.asyncio
+async def test_hedged_read_returns_first_answer():
+    delays = [1.0, 0.01]
+    started = []
+    async def read():
+        delay = delays[len(started)]
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+    loop = asyncio.get_running_loop()
+    begin = loop.time()
+    assert await hedged(read, 0.05) == 0.01
+    assert loop.time() - begin < 0.5
+    assert started == [1.0, 0.01]
+
+@pytest.mark.asyncio
+async def test_hedged_read_not_duplicated_when_fast():
+    calls = []
+    async def read():
+        calls.append(1)
+        return "fast"
+    assert await hedged(read, 0.05) == "fast"
+    assert len(calls) == 1
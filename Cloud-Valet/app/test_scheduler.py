@@ -0,0 +1,85 @@
+import pytest
+import datetime
+from types import SimpleNamespace
+from scheduler import CronSchedule, CronError, PowerScheduler
+
+UTC = datetime.timezone.utc
+
+def at(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+def test_cron_fields_ranges_steps_and_names():
+    cron = CronSchedule("*/15 8-9 * * mon-fri")
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == {8, 9}
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+    # Friday 2026-10-16 09:45 -> Monday 08:00
+    assert cron.next_after(at(2026, 10, 16, 9, 45)) == at(2026, 10, 19, 8, 0)
+
+@pytest.mark.parametrize("expression", ["* * *", "60 * * * *", "* * * 13 *", "*/0 * * * *", "a * * * *"])
+def test_invalid_cron_is_rejected(expression):
+    with pytest.raises(CronError):
+        CronSchedule(expression)
+
+def test_unknown_timezone_is_rejected():
+    with pytest.raises(CronError):
+        CronSchedule("0 8 * * *", "Mars/Olympus")
+
+def test_next_after_is_timezone_aware_across_dst():
+    cron = CronSchedule("0 8 * * *", "Europe/Amsterdam")
+    # 08:00 CEST is 06:00 UTC; after the switch back, 08:00 CET is 07:00 UTC
+    assert cron.next_after(at(2026, 10, 24, 12, 0)) == at(2026, 10, 25, 7, 0)
+    assert cron.next_after(at(2026, 10, 23, 12, 0)) == at(2026, 10, 24, 6, 0)
+    # 02:30 does not exist on the spring-forward day and is skipped
+    cron = CronSchedule("30 2 * * *", "Europe/Amsterdam")
+    assert cron.next_after(at(2026, 3, 28, 12, 0)) == at(2026, 3, 30, 0, 30)
+
+def test_day_of_month_or_weekday_when_both_restricted():
+    cron = CronSchedule("0 0 1 * sun")
+    # Sunday 2026-10-04 comes before the 1st of November
+    assert cron.next_after(at(2026, 10, 2)) == at(2026, 10, 4)
+
+def test_schedules_due_together_are_popped_in_one_batch():
+    clock = SimpleNamespace(now=at(2026, 10, 19, 7, 59).timestamp())
+    scheduler = PowerScheduler(load=None, fire=None, clock=lambda: clock.now)
+    scheduler.set_schedules([
+        SimpleNamespace(id=i, cron="0 8 * * *", timezone="UTC") for i in range(2000)
+    ] + [SimpleNamespace(id=9999, cron="30 8 * * *", timezone="UTC")])
+    assert scheduler.pop_due() == []
+    clock.now = at(2026, 10, 19, 8, 0, 1).timestamp()
+    due = scheduler.pop_due()
+    assert len(due) == 2000
+    assert {fire_at for _, fire_at in due} == {at(2026, 10, 19, 8, 0)}
+    # Each schedule is re-queued for its next firing
+    clock.now = at(2026, 10, 19, 8, 30).timestamp()
+    assert scheduler.pop_due() == [(9999, at(2026, 10, 19, 8, 30))]
+    clock.now = at(2026, 10, 20, 8, 0).timestamp()
+    assert len(scheduler.pop_due()) == 2000
+
+def test_reload_does_not_skip_a_due_firing():
+    clock = SimpleNamespace(now=at(2026, 10, 19, 7, 59, 30).timestamp())
+    scheduler = PowerScheduler(load=None, fire=None, clock=lambda: clock.now)
+    schedules = [SimpleNamespace(id=1, cron="0 8 * * *", timezone="UTC")]
+    scheduler.set_schedules(schedules)
+    scheduler.pop_due()
+    clock.now = at(2026, 10, 19, 8, 0, 5).timestamp()
+    scheduler.set_schedules(schedules)
+    assert scheduler.pop_due() == [(1, at(2026, 10, 19, 8, 0))]
+
+@pytest.mark.asyncio
+async def test_firing_that_cannot_load_inventory_is_audited(main_db, audited, monkeypatch):
+    import main, models
+    await main_db({models.PowerSchedule: [
+        {"id": 1, "name": "nightly-stop", "cron": "0 20 * * *", "timezone": "UTC", "action": "deallocate",
+         "target_type": "resourceGroup", "target": "rg0", "enabled": True},
+    ]})
+    async def load_inventory(force=False):
+        raise TimeoutError("sub/list timed out after 60s")
+    monkeypatch.setattr(main, "load_inventory", load_inventory)
+    fire_at = at(2026, 10, 19, 20, 0)
+    await main.run_due_schedules([(1, fire_at)])
+    assert audited == [(("scheduler", "schedule.run"), {"outcome": "error", "detail": {
+        "id": 1, "name": "nightly-stop", "action": "deallocate", "error": "sub/list timed out after 60s"}})]
+    # The firing was claimed, so another worker does not report it again
+    await main.run_due_schedules([(1, fire_at)])
+    assert len(audited) == 1
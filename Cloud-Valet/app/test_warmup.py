@@ -0,0 +1,60 @@
+import pytest
+import asyncio
+from warmup import WarmUp, Skipped
+
+@pytest.mark.asyncio
+async def test_steps_run_in_background_and_report_readiness():
+    order = []
+    token_ready = asyncio.Event()
+    async def database():
+        order.append("database")
+        return "5 connections"
+    async def token():
+        await token_ready.wait()
+        order.append("token")
+    async def inventory():
+        order.append("inventory")
+    async def broken():
+        raise RuntimeError("boom")
+    async def not_configured():
+        raise Skipped("no credentials")
+    warm_up = WarmUp()
+    warm_up.step("database", database)
+    warm_up.step("token", token)
+    warm_up.step("inventory", inventory, after="token")
+    warm_up.step("broken", broken)
+    warm_up.step("optional", not_configured)
+    assert warm_up.status()["state"] == "starting"
+    warm_up.start()
+    await asyncio.sleep(0.01)
+    assert not warm_up.ready and warm_up.status()["state"] == "warming"
+    assert "inventory" not in order
+    token_ready.set()
+    await asyncio.sleep(0.01)
+    assert warm_up.ready
+    assert order == ["database", "token", "inventory"]
+    steps = warm_up.status()["steps"]
+    assert steps["database"]["state"] == "done" and steps["database"]["detail"] == "5 connections"
+    assert steps["broken"] == {"state": "failed", "error": "boom"}
+    assert steps["optional"] == {"state": "skipped", "detail": "no credentials"}
+    await warm_up.stop()
+    assert not warm_up.ready and warm_up.status()["state"] == "stopping"
+
+@pytest.mark.asyncio
+async def test_slow_steps_time_out_and_worker_becomes_ready():
+    async def hang():
+        await asyncio.sleep(10)
+    warm_up = WarmUp(timeout=0.05)
+    warm_up.step("inventory", hang)
+    warm_up.start()
+    await asyncio.sleep(0.1)
+    assert warm_up.ready
+    assert warm_up.status()["steps"]["inventory"] == {"state": "timed out"}
+
+@pytest.mark.asyncio
+async def test_no_steps_is_ready_at_once():
+    warm_up = WarmUp()
+    warm_up.start()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert warm_up.ready
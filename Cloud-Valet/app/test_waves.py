@@ -0,0 +1,48 @@
+import pytest
+from waves import WavePlan, WaveError, split_waves, run_waves
+
+def vms(*names):
+    return [{"name": name, "resourceGroup": rg} for rg, name in names]
+
+def test_plan_validation():
+    plan = WavePlan.from_dict({"batchPercent": 25, "delay": 5, "groupBy": "tag", "maxFailures": 1})
+    assert (plan.batch_size, plan.batch_percent, plan.delay, plan.group_by, plan.max_failures) == (None, 25.0, 5.0, "tag", 1)
+    for options in ({}, {"batchSize": 2, "batchPercent": 10}, {"batchSize": 0}, {"batchSize": 1.5},
+                    {"batchPercent": 150}, {"batchSize": 1, "delay": -1}, {"batchSize": 1, "groupBy": "location"},
+                    {"batchSize": "2"}, "2"):
+        with pytest.raises(WaveError):
+            WavePlan.from_dict(options)
+
+def test_split_waves_by_group_and_percent():
+    machines = vms(("a", "web1"), ("b", "db1"), ("a", "web2"), ("a", "web3"), ("b", "db2"))
+    waves = split_waves(machines, WavePlan(batch_size=2), lambda vm: vm["resourceGroup"])
+    assert [(group, [vm["name"] for vm in wave]) for group, wave in waves] == [
+        ("a", ["web1", "web2"]), ("a", ["web3"]), ("b", ["db1", "db2"]),
+    ]
+    waves = split_waves(machines, WavePlan(batch_percent=50))
+    assert [len(wave) for _, wave in waves] == [3, 2]
+
+@pytest.mark.asyncio
+async def test_run_waves_times_each_wave_and_stops_past_failure_threshold():
+    now = [0.0]
+    slept = []
+    async def sleep(seconds):
+        slept.append(seconds)
+    async def act(wave):
+        now[0] += 2
+        return [{**vm, "status": "Error: boom" if vm["name"] == "vm3" else "VM running"} for vm in wave]
+    async def settle(results):
+        now[0] += 1
+        return results
+    machines = vms(*(("rg", f"vm{i}") for i in range(8)))
+    report = await run_waves(
+        split_waves(machines, WavePlan(batch_size=2)), act, settle, WavePlan(batch_size=2, delay=30),
+        is_failure=lambda r: r["status"].startswith("Error:"), clock=lambda: now[0], sleep=sleep,
+    )
+    assert report["stopped"] is True
+    assert [w["failed"] for w in report["waves"]] == [0, 1]
+    assert report["waves"][0] == {"wave": 1, "group": None, "vms": 2, "failed": 0,
+                                  "actionSeconds": 2.0, "healthSeconds": 1.0, "seconds": 3.0}
+    assert slept == [30]
+    assert [vm["name"] for vm in report["results"]] == ["vm0", "vm1", "vm2", "vm3"]
+    assert [vm["name"] for vm in report["skipped"]] == ["vm4", "vm5", "vm6", "vm7"]
@@ -0,0 +1,90 @@
+"""Background warm-up of a worker, and the state readiness checks report.
+
+Steps are named coroutines started together when the worker starts; a step
+can wait for another with ``after``. A step that raises ``Skipped`` does not
+apply (e.g. no Azure credentials); other errors are recorded and do not stop
+the remaining steps. The worker counts as ready once every step has finished
+one way or another, or once ``timeout`` seconds have passed, so a broken
+dependency cannot keep it out of rotation for good.
+"""
+import asyncio
+import time
+
+
+class Skipped(Exception):
+    pass
+
+
+class WarmUp:
+    def __init__(self, timeout=120.0, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.started_at = None
+        self.finished_at = None
+        self.stopping = False
+        self._steps = {}  # name -> (coroutine function, name of the step to wait for)
+        self._state = {}
+        self._task = None
+
+    def step(self, name, run, after=None):
+        self._steps[name] = (run, after)
+        self._state[name] = {"state": "pending"}
+
+    @property
+    def ready(self):
+        return self.finished_at is not None and not self.stopping
+
+    def start(self):
+        self.started_at = self.clock()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self.stopping = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def status(self):
+        if self.stopping:
+            state = "stopping"
+        elif self.finished_at is not None:
+            state = "ready"
+        else:
+            state = "warming" if self.started_at is not None else "starting"
+        status = {"state": state, "steps": {name: dict(step) for name, step in self._state.items()}}
+        if self.finished_at is not None:
+            status["seconds"] = round(self.finished_at - self.started_at, 3)
+        return status
+
+    async def _run(self):
+        done = {name: asyncio.Event() for name in self._steps}
+        async def run_step(name, run, after):
+            try:
+                if after is not None:
+                    await done[after].wait()
+                self._state[name] = {"state": "running"}
+                started = self.clock()
+                try:
+                    detail = await run()
+                except Skipped as e:
+                    self._state[name] = {"state": "skipped", "detail": str(e)}
+                except Exception as e:
+                    self._state[name] = {"state": "failed", "error": str(e) or type(e).__name__}
+                else:
+                    self._state[name] = {"state": "done", "seconds": round(self.clock() - started, 3)}
+                    if detail is not None:
+                        self._state[name]["detail"] = detail
+            finally:
+                done[name].set()
+        tasks = [asyncio.ensure_future(run_step(name, run, after)) for name, (run, after) in self._steps.items()]
+        try:
+            if tasks:
+                await asyncio.wait(tasks, timeout=self.timeout)
+            for name, step in self._state.items():
+                if step["state"] in ("pending", "running"):
+                    self._state[name] = {"state": "timed out"}
+        finally:
+            # Stop whatever is left (timed out, or the worker is shutting down)
+            for task in tasks:
+                task.cancel()
+            self.finished_at = self.clock()
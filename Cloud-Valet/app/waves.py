@@ -0,0 +1,114 @@
+"""Rolling-wave execution of a bulk VM action.
+
+Instead of acting on every VM at once, the VMs are split into waves of
+``batchSize`` VMs (or ``batchPercent`` of their group). With ``groupBy``,
+VMs are grouped first (by resource group or tag) and a wave never spans two
+groups, so a tier is rolled group by group. Each wave's action runs
+concurrently, then the runner waits until the wave is healthy before pausing
+``delay`` seconds and moving on. Once more than ``maxFailures`` VMs have
+failed (the action errored or the VM never became healthy), the remaining
+waves are skipped. The report has per-wave timings so operators can trade
+throughput against safety.
+"""
+import asyncio
+import math
+import time
+
+GROUP_BY = ("resourceGroup", "tag")
+
+
+class WaveError(ValueError):
+    pass
+
+
+def _number(options, name, default, minimum, integer=False):
+    value = options.get(name, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and value != int(value)):
+        raise WaveError(f"{name} must be {'an integer' if integer else 'a number'}")
+    if value < minimum:
+        raise WaveError(f"{name} must be at least {minimum}")
+    return int(value) if integer else float(value)
+
+
+class WavePlan:
+    def __init__(self, batch_size=None, batch_percent=None, delay=0.0, group_by=None,
+                 max_failures=0, health_timeout=300.0, health_interval=10.0):
+        self.batch_size = batch_size
+        self.batch_percent = batch_percent
+        self.delay = delay
+        self.group_by = group_by
+        self.max_failures = max_failures
+        self.health_timeout = health_timeout
+        self.health_interval = health_interval
+
+    @classmethod
+    def from_dict(cls, options):
+        if not isinstance(options, dict):
+            raise WaveError("waves must be an object")
+        batch_size = _number(options, "batchSize", None, 1, integer=True)
+        batch_percent = _number(options, "batchPercent", None, 0.01)
+        if (batch_size is None) == (batch_percent is None):
+            raise WaveError("waves needs exactly one of batchSize or batchPercent")
+        if batch_percent is not None and batch_percent > 100:
+            raise WaveError("batchPercent must be at most 100")
+        group_by = options.get("groupBy")
+        if group_by is not None and group_by not in GROUP_BY:
+            raise WaveError(f"groupBy must be one of {', '.join(GROUP_BY)}")
+        return cls(
+            batch_size=batch_size,
+            batch_percent=batch_percent,
+            delay=_number(options, "delay", 0, 0),
+            group_by=group_by,
+            max_failures=_number(options, "maxFailures", 0, 0, integer=True),
+            health_timeout=_number(options, "healthTimeout", 300, 1),
+            health_interval=_number(options, "healthInterval", 10, 0.1),
+        )
+
+
+def split_waves(vms, plan, group_of=lambda vm: None):
+    """[(group, VMs)] in order: groups in order of first appearance, each cut into batches."""
+    groups = {}
+    for vm in vms:
+        groups.setdefault(group_of(vm), []).append(vm)
+    waves = []
+    for group, members in groups.items():
+        size = plan.batch_size or max(1, math.ceil(len(members) * plan.batch_percent / 100))
+        for i in range(0, len(members), size):
+            waves.append((group, members[i:i + size]))
+    return waves
+
+
+async def run_waves(waves, act, settle, plan, is_failure, clock=time.monotonic, sleep=asyncio.sleep):
+    """Run ``act(VMs)`` then ``settle(results)`` for each wave in turn, stopping past ``plan.max_failures``."""
+    report = {"waves": [], "results": [], "stopped": False, "skipped": []}
+    failures = 0
+    for index, (group, vms) in enumerate(waves):
+        if index and plan.delay:
+            await sleep(plan.delay)
+        started = clock()
+        results = await act(vms)
+        acted = clock()
+        results = await settle(results)
+        finished = clock()
+        failed = sum(1 for result in results if is_failure(result))
+        failures += failed
+        report["results"].extend(results)
+        report["waves"].append({
+            "wave": index + 1,
+            "group": group,
+            "vms": len(vms),
+            "failed": failed,
+            "actionSeconds": round(acted - started, 3),
+            "healthSeconds": round(finished - acted, 3),
+            "seconds": round(finished - started, 3),
+        })
+        if failures > plan.max_failures:
+            report["stopped"] = True
+            report["skipped"] = [
+                {"name": vm.get("name"), "resourceGroup": vm.get("resourceGroup")}
+                for _, rest in waves[index + 1:] for vm in rest
+            ]
+            break
+    return report